@@ -1,7 +1,8 @@
 import os
 import re
-import shutil
+import time
 import requests
+import threading
 import mimetypes
 
 import yadisk
@@ -9,16 +10,22 @@ import pygsheets
 
 from os import path, makedirs
 from enum import Enum, IntEnum
+from concurrent.futures import ThreadPoolExecutor
 
 from google.oauth2.credentials import Credentials
 
 from pygsheets.client import Client
-from pygsheets import Cell, Spreadsheet, Worksheet
+from pygsheets import Cell, Spreadsheet, Worksheet, ValueRenderOption
 
 from pydrive2.drive import GoogleDrive
 from pydrive2.files import GoogleDriveFile
 from pydrive2.auth import GoogleAuth, AuthenticationError, RefreshError
 
+from utils.walker import TreeWalker
+from internal.downloader import Downloader
+from internal.retry import PermanentError
+from internal.snapshot import WorksheetSnapshot
+
 
 class CloudHandler(type):
 
@@ -33,7 +40,7 @@ class CloudHandler(type):
                 hasattr(subclass, 'get_sources_list') and
                 callable(subclass.get_sources_list))
 
-    def download(cls, url: str, dest: str):
+    def download(cls, url: str, dest: str, on_stream=None):
         pass
 
     def set_source(cls, source):
@@ -55,6 +62,7 @@ class GDriveCols(IntEnum):
     LINK: int = 18
     COMM: int = 19
     RES: int = 25
+    STATUS: int = 26
 
 
 class GDriveColors(Enum):
@@ -77,11 +85,26 @@ class GDriveHandler(metaclass=CloudHandler):
     # consts
 
     START_ROW: int = 4
+    DOWNLOAD_URL: str = 'https://www.googleapis.com/drive/v2/files/%s?alt=media'
+    FOLDER_MIME: str = 'application/vnd.google-apps.folder'
+    FIELDS: str = 'id,title,originalFilename,mimeType,exportLinks,fileExtension,md5Checksum,fileSize'
+
+    BATCH_SIZE: int = 100
+    PAGE_SIZE: int = 1000
+    LIST_WORKERS: int = 4
+
+    CHUNK_ROWS: int = 200
+
+    FLUSH_ROWS: int = 20
+    FLUSH_INTERVAL: int = 30
 
     # vars
 
     client: GoogleDrive = None
     pygsheets_client: Client = None
+    session: requests.Session = None
+    _http_local: threading.local = None
+    _auth_lock: threading.Lock = None
 
     available_sheets: dict = {}
     target_sheet: Spreadsheet = None
@@ -89,9 +112,29 @@ class GDriveHandler(metaclass=CloudHandler):
     available_worksheets: dict = {}
     target_worksheet: Worksheet = None
 
-    current_row: list[Cell] = []
+    current_row_no: int = 0
+
+    _marks: dict = {}
+    _marks_lock: threading.Lock = None
+    _flush_lock: threading.Lock = None
+    _last_flush: float = 0
+    _status_col_ready: bool = False
+    _sheets_lock: threading.Lock = None
+    _snapshot: WorksheetSnapshot = None
+    _row_keys: dict = {}
 
     def __init__(self):
+        self.session = Downloader().session
+        self._http_local = threading.local()
+        self._auth_lock = threading.Lock()
+        self._marks = {}
+        self._marks_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._sheets_lock = threading.RLock()
+        self._snapshot = WorksheetSnapshot()
+        self._row_keys = {}
+
         if not path.exists('.config/gdrive_creds.json'):
             open('.config/gdrive_creds.json', 'a').close()
 
@@ -110,78 +153,138 @@ class GDriveHandler(metaclass=CloudHandler):
             os.remove('.config/gdrive_creds.json')
             self.__init__()
 
-    def download(self, url: str, dest: str):
-        items = []
-        if ' ' in url:
-            links = url.split(' ')
-
-            for _link in links:
-
-                if "file/d/" in _link or 'presentation/d/' in _link:
-                    fid = re.findall(r'd/([\w\W]+)/', _link)[0]
-                    print(fid)
-                    file_obj = self.client.CreateFile({'id': fid})
-                    file_obj.FetchMetadata(fetch_all=True)
-                    items.append(file_obj)
-                elif "folders/" in _link:
-                    fid = re.findall(r'folders/([\w\W][^?]+)', _link)[0]
-                    items.extend(self.client.ListFile({'q': "'%s' in parents" % fid}).GetList())
-                elif 'folderview' in _link:
-                    fid = re.findall(r'id=([\w\W]+)', _link)[0]
-                    items.extend(self.client.ListFile({'q': "'%s' in parents" % fid}).GetList())
-        else:
-            if "file/d/" in url or 'presentation/d/' in url:
-                fid = re.findall(r'd/([\w\W]+)/', url)[0]
-                print(fid)
-                file_obj = self.client.CreateFile({'id': fid})
-                file_obj.FetchMetadata(fetch_all=True)
-                items = [file_obj]
-            elif "folders/" in url:
-                fid = re.findall(r'folders/([\w\W][^?]+)', url)[0]
-                items = self.client.ListFile({'q': "'%s' in parents" % fid}).GetList()
-            elif 'folderview' in url:
-                fid = re.findall(r'id=([\w\W]+)', url)[0]
-                items = self.client.ListFile({'q': "'%s' in parents" % fid}).GetList()
+    def download(self, url: str, dest: str, on_stream=None):
+        file_ids, folder_ids = self.parse_links(url)
+        files = self.get_files_metadata(file_ids)
+
+        if on_stream is not None and len(files) == 1 and len(folder_ids) == 0 and \
+                str(files[0].get('mimeType')).startswith('video/'):
+            on_stream(self._get_stream(files[0]))
+            return True
 
         dpath = '%s/%s' % ('.temp', dest)
         makedirs(dpath, exist_ok=True)
 
-        item: GoogleDriveFile
+        return Downloader().fetch_all(self._iter_jobs(self.iter_items(files, folder_ids), dpath))
+
+    def parse_links(self, url: str) -> tuple[list[str], list[str]]:
+        file_ids: list[str] = list()
+        folder_ids: list[str] = list()
+
+        for _link in url.split(' '):
+            if "file/d/" in _link or 'presentation/d/' in _link:
+                file_ids.append(re.findall(r'd/([\w\W]+)/', _link)[0])
+            elif "folders/" in _link:
+                folder_ids.append(re.findall(r'folders/([\w\W][^?]+)', _link)[0])
+            elif 'folderview' in _link:
+                folder_ids.append(re.findall(r'id=([\w\W]+)', _link)[0])
+
+        return file_ids, folder_ids
+
+    def _iter_jobs(self, items, dpath: str):
         for item in items:
-            try:
-                if item.metadata.get('mimeType') == 'application/vnd.google-apps.presentation':
-                    # _mime = 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
-                    _mime = 'application/pdf'
-                    link = item.metadata.get('exportLinks')[_mime]
-                    ext = mimetypes.guess_extension(_mime)
-                    filename = '%s%s' % (item.metadata.get('title'), ext)
+            if item.get('mimeType') == 'application/vnd.google-apps.presentation':
+                # _mime = 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
+                _mime = 'application/pdf'
+                link = item.get('exportLinks')[_mime]
+                ext = mimetypes.guess_extension(_mime)
+                filename = '%s%s' % (item.get('title'), ext)
 
-                    res = requests.get(link, stream=True)
+            else:
+                filename = re.sub(r'[\"?><:\\/|*]', '', item.get('originalFilename'))
+                (mime, _) = mimetypes.guess_type(filename)
 
-                    if res.status_code == 200:
-                        res.raw.decode_content = True
+                if mime is None and item.get('fileExtension') == '':
+                    filename = '%s%s' % (filename, mimetypes.guess_extension(item.get('mimeType')))
+                elif '.jfif' in filename:
+                    filename = filename.replace('.jfif', '.jpg')
 
-                        with open(os.path.join(dpath, filename), 'w+b') as f:
-                            shutil.copyfileobj(res.raw, f)
-                            f.flush()
+                link = self.DOWNLOAD_URL % item.get('id')
 
-                    else:
-                        return False
+            filename = Downloader.get_flat_name(item.get('subdir'), filename)
 
-                else:
-                    filename = re.sub(r'[\"?><:\\/|*]', '', item.metadata.get('originalFilename'))
-                    (mime, _) = mimetypes.guess_type(filename)
+            yield {'url': link, 'path': os.path.join(dpath, filename), 'headers': self.get_auth_headers,
+                   'key': 'gdrive:%s' % item.get('md5Checksum') if item.get('md5Checksum') else None}
 
-                    if mime is None and item.metadata.get('fileExtension') == '':
-                        filename = '%s%s' % (filename, mimetypes.guess_extension(item.metadata.get('mimeType')))
-                    elif '.jfif' in filename:
-                        filename = filename.replace('.jfif', '.jpg')
+    def iter_items(self, files: list[dict], folder_ids: list[str]):
+        for item in files:
+            if item.get('mimeType') == self.FOLDER_MIME:
+                folder_ids.append(item.get('id'))
+            else:
+                yield item
 
-                    item.GetContentFile("%s/%s" % (dpath, filename))
-            except:
-                return False
+        walker = TreeWalker(self._list_folder, self.LIST_WORKERS)
+        for item in walker.walk([{'id': fid, 'page': None, 'path': ''} for fid in folder_ids]):
+            yield item
 
-        return True
+    def get_files_metadata(self, file_ids: list[str]) -> list[dict]:
+        service = self.client.auth.service
+        results: dict = {}
+        errors: list = list()
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                errors.append(exception)
+            else:
+                results[int(request_id)] = response
+
+        for first in range(0, len(file_ids), self.BATCH_SIZE):
+            batch = service.new_batch_http_request(callback=callback)
+            for i, fid in enumerate(file_ids[first:first + self.BATCH_SIZE]):
+                batch.add(service.files().get(fileId=fid, fields=self.FIELDS), request_id=str(first + i))
+            batch.execute(http=self.get_http())
+
+        if len(errors) > 0:
+            raise errors[0]
+
+        return [results[i] for i in sorted(results)]
+
+    def _list_folder(self, node: dict) -> tuple[list, list]:
+        params = {
+            'q': "'%s' in parents and trashed=false" % node.get('id'),
+            'fields': 'nextPageToken,items(%s)' % self.FIELDS,
+            'maxResults': self.PAGE_SIZE
+        }
+        if node.get('page') is not None:
+            params['pageToken'] = node.get('page')
+
+        response = self.client.auth.service.files().list(**params).execute(http=self.get_http())
+
+        files = [dict(item, subdir=node.get('path')) for item in response.get('items', [])
+                 if item.get('mimeType') != self.FOLDER_MIME]
+        nodes = [{'id': item.get('id'), 'page': None, 'path': '%s/%s' % (node.get('path'), item.get('title'))}
+                 for item in response.get('items', []) if item.get('mimeType') == self.FOLDER_MIME]
+
+        if response.get('nextPageToken'):
+            nodes.append({'id': node.get('id'), 'page': response.get('nextPageToken'), 'path': node.get('path')})
+
+        return files, nodes
+
+    def get_http(self):
+        # httplib2 is not thread-safe, each worker thread gets its own authorized Http object
+        http = getattr(self._http_local, 'http', None)
+        if http is None:
+            http = self.client.auth.Get_Http_Object()
+            self._http_local.http = http
+
+        return http
+
+    def _get_stream(self, item: dict) -> dict:
+        return {
+            'name': re.sub(r'[\"?><:\\/|*]', '', item.get('originalFilename') or item.get('title')),
+            'size': int(item.get('fileSize')),
+            'url': self.DOWNLOAD_URL % item.get('id'),
+            'headers': self.get_auth_headers,
+            'session': self.session
+        }
+
+    def get_auth_headers(self) -> dict:
+        auth = self.client.auth
+        with self._auth_lock:
+            if auth.access_token_expired:
+                auth.Refresh()
+
+        return {'Authorization': 'Bearer %s' % auth.credentials.access_token}
 
     def get_sources_list(self) -> list:
         sheets = self.client.ListFile({
@@ -212,46 +315,131 @@ class GDriveHandler(metaclass=CloudHandler):
         return sheets
 
     def set_worksheet(self, title: str):
-        self.target_worksheet = self.target_sheet.worksheet_by_title(title)
+        with self._flush_lock:
+            self._flush()
+
+            self.target_worksheet = self.target_sheet.worksheet_by_title(title)
+            self._status_col_ready = False
 
     def get_last_row_id(self) -> int:
-        empty_cell_id: int = 0
-        c: Cell
-        for c in self.target_worksheet.get_col(col=GDriveCols.ID+1, returnas='cell'):
-            if c.value_unformatted == '' and c.row > 5:
-                empty_cell_id = c.row
+        first = self.START_ROW + 2
+        with self._sheets_lock:
+            res = self.pygsheets_client.sheet.values_get(
+                self.target_sheet.id, "'%s'!%s%i:%s" % (self.target_worksheet.title.replace("'", "''"),
+                                                         self._get_col_letter(GDriveCols.ID), first,
+                                                         self._get_col_letter(GDriveCols.ID)),
+                major_dimension='COLUMNS', value_render_option=ValueRenderOption.UNFORMATTED_VALUE)
+
+        values = (res.get('values') or [[]])[0]
+        last_row_id = first - 1 + len(values)
+        for i, value in enumerate(values):
+            if value == '':
+                last_row_id = first - 1 + i
                 break
 
-        return empty_cell_id-1
+        return last_row_id
+
+    def get_rows(self, start: int, end: int, only_changed: bool = False):
+        first, last = start + self.START_ROW, end + self.START_ROW
+        chunks = [(_first, min(_first + self.CHUNK_ROWS - 1, last))
+                  for _first in range(first, last + 1, self.CHUNK_ROWS)]
+        if len(chunks) == 0:
+            return
+
+        done = self._snapshot.get_done(self.target_sheet.id, self.target_worksheet.id) if only_changed else {}
+        done_states = (GDriveItemStates.FINISHED.value, GDriveItemStates.SKIPPED.value)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(self._fetch_rows, *chunks[0])
+
+            for i in range(len(chunks)):
+                rows = future.result()
+                if i + 1 < len(chunks):
+                    future = executor.submit(self._fetch_rows, *chunks[i + 1])
+
+                for row in rows:
+                    if self.is_value_excluded(row.get('res')):
+                        continue
 
-    def get_rows(self, start: int, end: int):
-        cells: list[Cell]
-        for cells in self.target_worksheet.get_values(start=(start + self.START_ROW, GDriveCols.ID+1),
-                                                      end=(end + self.START_ROW, GDriveCols.RES+1), returnas='cell'):
-            if self.is_row_excluded(cells):
+                    if only_changed and not self._snapshot.is_changed(done, row, done_states):
+                        continue
+
+                    self._row_keys[row.get('no')] = (row.get('id'), self._snapshot.get_hash(row))
+                    self.current_row_no = row.get('no')
+                    yield row
+
+    def _fetch_rows(self, first: int, last: int) -> list[dict]:
+        title = "'%s'" % self.target_worksheet.title.replace("'", "''")
+
+        runs: list[list[int]] = list()
+        for col in sorted(int(c) for c in GDriveCols if c != GDriveCols.STATUS):
+            if len(runs) > 0 and runs[-1][1] + 1 == col:
+                runs[-1][1] = col
+            else:
+                runs.append([col, col])
+
+        ranges = ['%s!%s%i:%s%i' % (title, self._get_col_letter(a), first, self._get_col_letter(b), last)
+                  for a, b in runs]
+
+        with self._sheets_lock:
+            raw = self.pygsheets_client.sheet.values_batch_get(self.target_sheet.id, ranges, major_dimension='COLUMNS',
+                                                                value_render_option=ValueRenderOption.UNFORMATTED_VALUE)
+            age = self.pygsheets_client.sheet.values_get(self.target_sheet.id, '%s!%s%i:%s%i' % (
+                title, self._get_col_letter(GDriveCols.AGE), first, self._get_col_letter(GDriveCols.AGE), last),
+                major_dimension='COLUMNS', value_render_option=ValueRenderOption.FORMATTED_VALUE)
+
+        if isinstance(raw, dict):
+            raw = raw.get('valueRanges', [])
+
+        columns: dict = {}
+        for (a, _), value_range in zip(runs, raw):
+            for i, values in enumerate(value_range.get('values', [])):
+                columns[a + i] = values
+        columns[-1] = (age.get('values') or [[]])[0]
+
+        def value(col: int, i: int):
+            values = columns.get(col, [])
+            return values[i] if i < len(values) else ''
+
+        rows: list[dict] = list()
+        for i in range(last - first + 1):
+            if value(GDriveCols.ID, i) == '':
                 continue
 
-            self.current_row = cells
-            yield {
-                'no': int(cells[GDriveCols.ID].row),
-                'id': int(cells[GDriveCols.ID].value_unformatted),
-                'school': cells[GDriveCols.SCHOOL].value_unformatted,
-                'group': cells[GDriveCols.GROUP].value_unformatted,
-                'student': cells[GDriveCols.STUDENT].value_unformatted,
-                'age': cells[GDriveCols.AGE].value,
-                'tutor': cells[GDriveCols.TUTOR].value_unformatted,
-                'title': str(cells[GDriveCols.TITLE].value_unformatted),
-                'materials': cells[GDriveCols.MATERIALS].value_unformatted,
-                'link': cells[GDriveCols.LINK].value_unformatted,
-                'comm': cells[GDriveCols.COMM].value_unformatted,
-                'res': cells[GDriveCols.RES].value_unformatted
-            }
+            rows.append({
+                'no': first + i,
+                'id': int(value(GDriveCols.ID, i)),
+                'school': value(GDriveCols.SCHOOL, i),
+                'group': value(GDriveCols.GROUP, i),
+                'student': value(GDriveCols.STUDENT, i),
+                'age': value(-1, i),
+                'tutor': value(GDriveCols.TUTOR, i),
+                'title': str(value(GDriveCols.TITLE, i)),
+                'materials': value(GDriveCols.MATERIALS, i),
+                'link': str(value(GDriveCols.LINK, i)),
+                'comm': value(GDriveCols.COMM, i),
+                'res': str(value(GDriveCols.RES, i))
+            })
+
+        return rows
+
+    def _get_col_letter(self, col: int) -> str:
+        letters = ''
+        col = int(col) + 1
+        while col > 0:
+            col, rem = divmod(col - 1, 26)
+            letters = chr(65 + rem) + letters
+
+        return letters
 
     def is_row_excluded(self, row: list[Cell]) -> bool:
         return self.is_excluded(row[GDriveCols.RES])
 
     def is_excluded(self, cell: Cell) -> bool:
-        return any(res in cell.value_unformatted for res in [ 'аннулирован'])
+        return self.is_value_excluded(cell.value_unformatted)
+
+    def is_value_excluded(self, value: str) -> bool:
+        return any(res in value for res in ['аннулирован'])
 # 'Гран-при', 'Специальный', 'Лауреат I степени'
     def is_repeated(self, cell: Cell) -> bool:
         return 'повтор' in cell.value_unformatted.lower() or 'копия' in cell.value_unformatted.lower()
@@ -267,65 +455,235 @@ class GDriveHandler(metaclass=CloudHandler):
         return cell.color == GDriveColors.GREY.value or cell.color == GDriveColors.BLUE.value or\
                cell.color == GDriveColors.GREEN.value or cell.color == GDriveColors.RED.value
 
-    def mark_as(self, state: int):
-        if state == GDriveItemStates.FAILED:
-            self.current_row[GDriveCols.TITLE].color = GDriveColors.RED.value
-        elif state == GDriveItemStates.SKIPPED:
-            self.current_row[GDriveCols.TITLE].color = GDriveColors.BLUE.value
-        elif state == GDriveItemStates.FINISHED:
-            self.current_row[GDriveCols.TITLE].color = GDriveColors.GREY.value
-        elif state == GDriveItemStates.PARTIAL:
-            self.current_row[GDriveCols.TITLE].color = GDriveColors.GREEN.value
+    def mark_as(self, state: int, no: int = None, result: str = '', links: list = None):
+        if no is None:
+            no = self.current_row_no
+
+        with self._marks_lock:
+            self._marks[no] = (state, result, links or [])
+            due = len(self._marks) >= self.FLUSH_ROWS or time.monotonic() - self._last_flush >= self.FLUSH_INTERVAL
+
+        if due:
+            self.flush()
+
+    def flush_if_due(self):
+        with self._marks_lock:
+            due = len(self._marks) > 0 and time.monotonic() - self._last_flush >= self.FLUSH_INTERVAL
+
+        if due:
+            self.flush()
+
+    def flush(self):
+        # The timer and mark_as may flush at the same time, only one of them may add the status column
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._marks_lock:
+            marks = self._marks
+            self._marks = {}
+            self._last_flush = time.monotonic()
+
+        if len(marks) == 0 or self.target_worksheet is None:
+            return
+
+        colors = {
+            GDriveItemStates.FAILED: GDriveColors.RED.value,
+            GDriveItemStates.SKIPPED: GDriveColors.BLUE.value,
+            GDriveItemStates.FINISHED: GDriveColors.GREY.value,
+            GDriveItemStates.PARTIAL: GDriveColors.GREEN.value
+        }
+
+        sheet_id = self.target_worksheet.id
+        requests_: list[dict] = list()
+
+        cols = None
+        if not self._status_col_ready:
+            # The cached grid size may be stale after the worksheet was selected again, the real one is read
+            try:
+                with self._sheets_lock:
+                    self.target_worksheet.refresh(False)
+                cols = self.target_worksheet.cols
+            except:
+                print('Не удалось получить размер листа')
+
+            if cols is not None and cols <= GDriveCols.STATUS:
+                requests_.append({'appendDimension': {'sheetId': sheet_id, 'dimension': 'COLUMNS',
+                                                      'length': GDriveCols.STATUS + 1 - cols}})
+
+        for no, (state, result, links) in marks.items():
+            color = colors.get(state)
+            if color is not None:
+                requests_.append(self._get_cell_request(sheet_id, no, GDriveCols.TITLE, {
+                    'userEnteredFormat': {'backgroundColor': dict(zip(('red', 'green', 'blue', 'alpha'), color))}
+                }, 'userEnteredFormat.backgroundColor'))
+
+            requests_.append(self._get_cell_request(sheet_id, no, GDriveCols.STATUS, {
+                'userEnteredValue': {'stringValue': '\n'.join([result] + links)}
+            }, 'userEnteredValue'))
+
+        try:
+            with self._sheets_lock:
+                self.pygsheets_client.sheet.batch_update(self.target_sheet.id, requests_)
+
+            if cols is not None:
+                self._status_col_ready = True
+                if cols <= GDriveCols.STATUS:
+                    self.target_worksheet.jsonSheet['properties']['gridProperties']['columnCount'] = \
+                        GDriveCols.STATUS + 1
+
+            self._snapshot.commit(self.target_sheet.id, self.target_worksheet.id,
+                                  [self._row_keys.get(no) + (state.value,) for no, (state, _, _) in marks.items()
+                                   if no in self._row_keys])
+        except:
+            print('Ошибка при записи результатов в таблицу')
+
+            with self._marks_lock:
+                for no, mark in marks.items():
+                    self._marks.setdefault(no, mark)
+
+    def _get_cell_request(self, sheet_id: int, no: int, col: int, value: dict, fields: str) -> dict:
+        return {
+            'updateCells': {
+                'range': {
+                    'sheetId': sheet_id,
+                    'startRowIndex': no - 1,
+                    'endRowIndex': no,
+                    'startColumnIndex': int(col),
+                    'endColumnIndex': int(col) + 1
+                },
+                'rows': [{'values': [value]}],
+                'fields': fields
+            }
+        }
 
 
 class MailRuHandler(metaclass=CloudHandler):
 
-    def download(self, url: str, dest: str):
-        weblink = re.findall(r'/public/(\w+/\w+)', url)[0]
+    # consts
+
+    LIST_URL: str = 'https://cloud.mail.ru/api/v4/public/list?weblink='
+    DISPATCHER_URL: str = 'https://cloud.mail.ru/api/v2/dispatcher'
+    DISPATCHER_TTL: int = 1800
+
+    PAGE_SIZE: int = 500
+    LIST_WORKERS: int = 4
 
-        items_r = requests.get("https://cloud.mail.ru/api/v4/public/list?weblink=" + weblink)
-        links_r = requests.get("https://cloud.mail.ru/api/v2/dispatcher", headers={"referer": url})
+    # vars
 
-        if items_r.status_code != 200 | links_r.status_code != 200:
+    session: requests.Session = None
 
-            return False
+    _dispatcher: tuple = None
+    _dispatcher_lock: threading.Lock = None
 
-        items = items_r.json()
-        links = links_r.json()
+    def __init__(self):
+        self.session = Downloader().session
+        self._dispatcher_lock = threading.Lock()
 
-        weblink_get = links.get('body').get('weblink_get')[0].get('url')
+    def download(self, url: str, dest: str, on_stream=None):
+        weblinks = re.findall(r'/public/(\w+/\w+)', url)
+        if len(weblinks) == 0:
+            raise PermanentError('Ссылка не поддерживается')
+
+        items = list(TreeWalker(self._list_public_dir, self.LIST_WORKERS)
+                     .walk([{'weblink': weblink, 'offset': 0, 'path': ''} for weblink in weblinks]))
+
+        if on_stream is not None and len(items) == 1 and self._is_video(items[0].get('name')):
+            weblink_get = self.get_weblink_get(url)
+            if weblink_get is None:
+                return False
 
-        if items.get('type') == "folder":
-            item_list = items.get('list')
-        else:
-            item_list = [items]
+            on_stream({
+                'name': re.sub(r'[\"?><:\\/|*]', '', items[0].get('name')),
+                'size': int(items[0].get('size')),
+                'url': weblink_get + "/" + items[0].get('weblink'),
+                'session': self.session
+            })
+            return True
 
         dpath = os.path.join(os.getcwd(), '.temp', dest)
         makedirs(dpath, exist_ok=True)
 
-        if len(item_list) == 0:
-            return False
+        # A stale weblink_get answers with 4xx, in that case the dispatcher is asked again once
+        for attempt in range(2):
+            weblink_get = self.get_weblink_get(url)
+            if weblink_get is None:
+                return False
+
+            invalidated: list = list()
+            jobs = self._get_jobs(items, weblink_get, dpath)
+            try:
+                return Downloader().fetch_all(jobs,
+                                              on_error=lambda status: invalidated.append(self.invalidate(status)))
+            except requests.HTTPError:
+                if attempt > 0 or not any(invalidated):
+                    raise
 
-        for item in item_list:
-            item_link = weblink_get + "/" + item.get('weblink')
+        return False
+
+    def _get_jobs(self, items: list[dict], weblink_get: str, dpath: str) -> list[dict]:
+        jobs: list[dict] = list()
+        for item in items:
             filename = re.sub(r'[\"?><:\\/|*]', '', item.get("name"))
 
             if '.jfif' in filename:
                 filename = filename.replace('.jfif', '.jpg')
 
-            img = requests.get(item_link, stream=True)
+            filename = Downloader.get_flat_name(item.get('subdir'), filename)
 
-            if img.status_code == 200:
-                img.raw.decode_content = True
+            jobs.append({'url': weblink_get + "/" + item.get('weblink'), 'path': os.path.join(dpath, filename),
+                         'key': 'mailru:%s:%s' % (item.get('weblink'), item.get('size'))})
 
-                with open(os.path.join(dpath, filename), 'w+b') as f:
-                    shutil.copyfileobj(img.raw, f)
-                    f.flush()
+        return jobs
 
-            else:
-                return False
+    def _list_public_dir(self, node: dict) -> tuple[list, list]:
+        res = self.session.get('%s%s&offset=%i&limit=%i' % (self.LIST_URL, node.get('weblink'), node.get('offset'),
+                                                             self.PAGE_SIZE))
+        if res.status_code != 200:
+            raise requests.HTTPError('Ошибка при получении списка файлов: %i' % res.status_code,
+                                     response=res)
 
-        return True
+        data = res.json()
+        if data.get('type') != "folder":
+            return [data], []
+
+        items = data.get('list') or []
+        files = [dict(item, subdir=node.get('path')) for item in items if item.get('type') != "folder"]
+        nodes = [{'weblink': item.get('weblink'), 'offset': 0, 'path': '%s/%s' % (node.get('path'), item.get('name'))}
+                 for item in items if item.get('type') == "folder"]
+
+        count = data.get('count') or {}
+        offset = node.get('offset') + len(items)
+        if len(items) > 0 and offset < count.get('folders', 0) + count.get('files', 0):
+            nodes.append({'weblink': node.get('weblink'), 'offset': offset, 'path': node.get('path')})
+
+        return files, nodes
+
+    def get_weblink_get(self, referer: str):
+        with self._dispatcher_lock:
+            if self._dispatcher is not None and time.monotonic() - self._dispatcher[1] < self.DISPATCHER_TTL:
+                return self._dispatcher[0]
+
+            links_r = self.session.get(self.DISPATCHER_URL, headers={"referer": referer})
+            if links_r.status_code != 200:
+                return None
+
+            weblink_get = links_r.json().get('body').get('weblink_get')[0].get('url')
+            self._dispatcher = (weblink_get, time.monotonic())
+
+            return weblink_get
+
+    def invalidate(self, status: int) -> bool:
+        if 400 <= status < 500:
+            with self._dispatcher_lock:
+                self._dispatcher = None
+            return True
+
+        return False
+
+    def _is_video(self, name: str) -> bool:
+        (mime, _) = mimetypes.guess_type(name)
+        return mime is not None and mime.startswith('video/')
 
     def set_source(cls, source):
         pass
@@ -336,49 +694,54 @@ class MailRuHandler(metaclass=CloudHandler):
 
 class YaDiskHandler(metaclass=CloudHandler):
 
-    def download(self, url: str, dest: str):
-        disk = yadisk.YaDisk()
-
-        items = []
-        url = ''.join(re.findall(r'(https://[^а-я\s]+)', url, re.IGNORECASE))
-
-        if ' ' in url:
-            urls = url.split(' ')
-
-            for url_i in urls:
-                data: yadisk.objects.PublicResourceObject
-                try:
-                    data = disk.get_public_meta(url_i)
-                except:
-                    return False
-
-                if data.type == "dir":
-                    items.extend(data.embedded.items)
-                else:
-                    items.append(data)
-            print(items)
-        else:
-            data: yadisk.objects.PublicResourceObject
-            try:
-                data = disk.get_public_meta(url)
-                print(data)
-            except:
-                return False
+    # consts
 
-            if data.type == "dir":
-                items = data.embedded.items
-            else:
-                items = [data]
+    PAGE_SIZE: int = 100
+    LIST_WORKERS: int = 4
+
+    # vars
+
+    disk: yadisk.YaDisk = None
+    session: requests.Session = None
+
+    def __init__(self):
+        self.disk = yadisk.YaDisk()
+        self.session = Downloader().session
+
+    def download(self, url: str, dest: str, on_stream=None):
+        urls = re.findall(r'(https://[^а-я\s]+)', url, re.IGNORECASE)
+        if len(urls) == 0:
+            raise PermanentError('Ссылка не поддерживается')
+
+        files: list = list()
+        roots = [{'key': url, 'path': None, 'offset': 0} for url in urls]
+
+        if on_stream is not None and len(urls) == 1:
+            files, roots = self._list_public_dir(roots[0])
+            if len(roots) == 0 and len(files) == 1 and str(files[0].mime_type).startswith('video/'):
+                on_stream({
+                    'name': re.sub(r'[\"?><:\\/|*]', '', files[0].name),
+                    'size': int(files[0].size),
+                    'url': files[0].file,
+                    'session': self.session
+                })
+                return True
 
         dpath = os.path.join(os.getcwd(), '.temp', dest)
         makedirs(dpath, exist_ok=True)
 
-        item: yadisk.objects.PublicResourceObject
-        for item in items:
-            if item.type == "dir":
-                items.extend(item.embedded.items)
-                continue
+        return Downloader().fetch_all(self._iter_jobs(files, roots, dpath))
+
+    def _iter_items(self, files: list, roots: list[dict]):
+        for item in files:
+            yield item
 
+        for item in TreeWalker(self._list_public_dir, self.LIST_WORKERS).walk(roots):
+            yield item
+
+    def _iter_jobs(self, files: list, roots: list[dict], dpath: str):
+        item: yadisk.objects.PublicResourceObject
+        for item in self._iter_items(files, roots):
             filename = re.sub(r'[\"?><:\\/|*]', '', item.name)
             (mime, _) = mimetypes.guess_type(filename)
 
@@ -387,17 +750,32 @@ class YaDiskHandler(metaclass=CloudHandler):
             elif '.jfif' in filename:
                 filename = filename.replace('.jfif', '.jpg')
 
-            file = requests.get(item.file, stream=True)
-            if file.status_code == 200:
-                file.raw.decode_content = True
+            filename = Downloader.get_flat_name(os.path.dirname(item.path or ''), filename)
 
-                with open("%s/%s" % (dpath, filename), "wb") as f:
-                    shutil.copyfileobj(file.raw, f)
+            digest = item.sha256 or item.md5
+            yield {'url': item.file, 'path': "%s/%s" % (dpath, filename),
+                   'key': 'yadisk:%s' % digest if digest else None}
 
-            else:
-                return False
+    def _list_public_dir(self, node: dict) -> tuple[list, list]:
+        data: yadisk.objects.PublicResourceObject
+        try:
+            data = self.disk.get_public_meta(node.get('key'), path=node.get('path'), limit=self.PAGE_SIZE,
+                                             offset=node.get('offset'))
+        except (yadisk.exceptions.NotFoundError, yadisk.exceptions.ForbiddenError) as e:
+            raise PermanentError('Ссылка недоступна') from e
 
-        return True
+        if data.type != "dir":
+            return [data], []
+
+        items = data.embedded.items
+        files = [item for item in items if item.type != "dir"]
+        nodes = [{'key': node.get('key'), 'path': item.path, 'offset': 0} for item in items if item.type == "dir"]
+
+        offset = node.get('offset') + len(items)
+        if len(items) > 0 and offset < data.embedded.total:
+            nodes.append({'key': node.get('key'), 'path': node.get('path'), 'offset': offset})
+
+        return files, nodes
 
     def set_source(self, source):
         pass
@@ -0,0 +1,97 @@
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+
+from internal.settings import Settings
+from utils.singleton import Singleton
+
+
+class DownloadCache(metaclass=Singleton):
+
+    # consts
+
+    MAX_SIZE: int = 10 * 1024 * 1024 * 1024
+
+    # vars
+
+    _cache_path: str = os.path.join(os.getcwd(), '.cache')
+    _files_path: str = os.path.join(_cache_path, 'files')
+    _db_path: str = os.path.join(_cache_path, 'index.db')
+
+    _max_size: int = 0
+    _conn: sqlite3.Connection = None
+    _lock: threading.Lock = None
+
+    def __init__(self):
+        os.makedirs(self._files_path, exist_ok=True)
+
+        size_mb = Settings().get_value('cache_size_mb')
+        self._max_size = int(size_mb) * 1024 * 1024 if size_mb else self.MAX_SIZE
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self._db_path, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS files ('
+                           'key TEXT PRIMARY KEY, name TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)')
+        self._conn.commit()
+
+    def _get_file_path(self, key: str) -> str:
+        return os.path.join(self._files_path, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key: str, dest: str) -> bool:
+        file_path = self._get_file_path(key)
+
+        with self._lock:
+            found = self._conn.execute('SELECT 1 FROM files WHERE key = ?', (key,)).fetchone() is not None
+            if found and not os.path.exists(file_path):
+                self._conn.execute('DELETE FROM files WHERE key = ?', (key,))
+                self._conn.commit()
+                return False
+            elif not found:
+                return False
+
+            self._conn.execute('UPDATE files SET last_used = ? WHERE key = ?', (time.time(), key))
+            self._conn.commit()
+
+        # A copy, not a link: conversions rewrite downloaded files in place
+        shutil.copyfile(file_path, dest)
+
+        return True
+
+    def put(self, key: str, src: str):
+        file_path = self._get_file_path(key)
+        size = os.path.getsize(src)
+        if size > self._max_size:
+            return
+
+        tmp_path = '%s.%i.tmp' % (file_path, threading.get_ident())
+        shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, file_path)
+
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO files (key, name, size, last_used) VALUES (?, ?, ?, ?)',
+                               (key, os.path.basename(src), size, time.time()))
+            self._conn.commit()
+
+            self._evict()
+
+    def _evict(self):
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM files').fetchone()[0]
+        if total <= self._max_size:
+            return
+
+        # Least recently used files go first
+        for key, size in self._conn.execute('SELECT key, size FROM files ORDER BY last_used').fetchall():
+            if total <= self._max_size:
+                break
+
+            file_path = self._get_file_path(key)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+            self._conn.execute('DELETE FROM files WHERE key = ?', (key,))
+            total -= size
+
+        self._conn.commit()
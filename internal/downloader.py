@@ -0,0 +1,239 @@
+import os
+import re
+import json
+import threading
+import requests
+
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from utils.singleton import Singleton
+from internal.downloadCache import DownloadCache
+from internal.retry import PermanentError, is_permanent
+
+
+class Downloader(metaclass=Singleton):
+
+    # consts
+
+    WORKERS: int = 16
+    HOST_LIMIT: int = 4
+    CHUNK_SIZE: int = 1024 * 1024
+    TIMEOUT: int = 60
+
+    SEGMENT_THRESHOLD: int = 32 * 1024 * 1024
+    SEGMENT_SIZE: int = 16 * 1024 * 1024
+    SEGMENT_CONNECTIONS: int = 4
+    SEGMENT_RETRIES: int = 3
+
+    # vars
+
+    session: requests.Session = None
+
+    _executor: ThreadPoolExecutor = None
+    _hosts: dict = {}
+    _hosts_lock: threading.Lock = None
+
+    def __init__(self):
+        self.session = requests.Session()
+
+        adapter = HTTPAdapter(pool_connections=self.WORKERS, pool_maxsize=self.WORKERS)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=self.WORKERS)
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+
+    @staticmethod
+    def get_flat_name(subdir: str, filename: str) -> str:
+        # Files from subfolders keep their folder in the name, the row folder itself stays flat
+        parts = [re.sub(r'[\"?><:\\/|*]', '', part) for part in (subdir or '').split('/') if part != '']
+        return ' - '.join(parts + [filename])
+
+    def get_host_limit(self, url: str) -> threading.Semaphore:
+        host = urlparse(url).netloc
+
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.Semaphore(self.HOST_LIMIT)
+
+            return self._hosts.get(host)
+
+    def fetch(self, url: str, file_path: str, headers: dict = None, on_error=None) -> bool:
+        segmented = None
+
+        with self.get_host_limit(url):
+            res = self.session.get(url, headers=headers, stream=True, timeout=self.TIMEOUT)
+
+            try:
+                if res.status_code != 200:
+                    if on_error is not None:
+                        on_error(res.status_code)
+                    # The status is passed up so a missing file is not retried like an overloaded server
+                    raise requests.HTTPError('%i при скачивании %s' % (res.status_code, url), response=res)
+
+                size = int(res.headers.get('Content-Length') or 0)
+                if res.headers.get('Accept-Ranges') == 'bytes' and size >= self.SEGMENT_THRESHOLD and \
+                        'Content-Encoding' not in res.headers:
+                    segmented = (res.url, size)
+                else:
+                    with open(file_path, 'wb') as f:
+                        for chunk in res.iter_content(chunk_size=self.CHUNK_SIZE):
+                            f.write(chunk)
+            finally:
+                res.close()
+
+        # The slot is given back first, each segment then takes its own slot on the host it was redirected to
+        if segmented is not None:
+            return self.fetch_segmented(segmented[0], file_path, segmented[1], headers)
+
+        return True
+
+    def fetch_segmented(self, url: str, file_path: str, size: int, headers: dict = None) -> bool:
+        state = self._load_state(file_path, size)
+        if state is None:
+            state = {
+                'size': size,
+                'segments': [[start, min(start + self.SEGMENT_SIZE, size) - 1, start]
+                             for start in range(0, size, self.SEGMENT_SIZE)]
+            }
+
+            with open(file_path, 'wb') as f:
+                f.truncate(size)
+
+        lock = threading.Lock()
+        pending = [segment for segment in state.get('segments') if segment[2] <= segment[1]]
+
+        with ThreadPoolExecutor(max_workers=self.SEGMENT_CONNECTIONS) as executor:
+            results = list(executor.map(lambda segment: self._fetch_segment(url, file_path, segment, headers,
+                                                                            state, lock), pending))
+
+        if all(results):
+            if os.path.exists(self._get_state_path(file_path)):
+                os.remove(self._get_state_path(file_path))
+            return True
+
+        self._save_state(file_path, state, lock)
+        return False
+
+    def _fetch_segment(self, url: str, file_path: str, segment: list, headers: dict, state: dict,
+                       lock: threading.Lock) -> bool:
+        for _ in range(self.SEGMENT_RETRIES):
+            # Every attempt continues from the last byte written for this segment
+            _headers = dict(headers or {})
+            _headers['Range'] = 'bytes=%i-%i' % (segment[2], segment[1])
+
+            try:
+                with self.get_host_limit(url):
+                    res = self.session.get(url, headers=_headers, stream=True, timeout=self.TIMEOUT)
+
+                    try:
+                        if res.status_code != 206:
+                            continue
+
+                        with open(file_path, 'r+b') as f:
+                            f.seek(segment[2])
+                            for chunk in res.iter_content(chunk_size=self.CHUNK_SIZE):
+                                f.write(chunk)
+                                segment[2] += len(chunk)
+                    finally:
+                        res.close()
+
+                if segment[2] > segment[1]:
+                    self._save_state(file_path, state, lock)
+                    return True
+            except:
+                self._save_state(file_path, state, lock)
+
+        return False
+
+    def _get_state_path(self, file_path: str) -> str:
+        return '%s.part' % file_path
+
+    def _load_state(self, file_path: str, size: int):
+        if not os.path.exists(file_path) or not os.path.exists(self._get_state_path(file_path)):
+            return None
+
+        try:
+            with open(self._get_state_path(file_path), 'r') as f:
+                state = json.loads(f.readline())
+        except:
+            return None
+
+        if state.get('size') != size or os.path.getsize(file_path) != size:
+            return None
+
+        return state
+
+    def _save_state(self, file_path: str, state: dict, lock: threading.Lock):
+        with lock:
+            with open(self._get_state_path(file_path), 'w+') as f:
+                f.write(json.dumps(state))
+
+    def fetch_job(self, job: dict, on_error=None) -> bool:
+        # Jobs with a content key are served from the local cache when the same file was fetched before
+        key = job.get('key')
+        if key is not None:
+            try:
+                if DownloadCache().get(key, job.get('path')):
+                    return True
+            except:
+                pass
+
+        headers = job.get('headers')
+        if callable(headers):
+            headers = headers()
+
+        if not self.fetch(job.get('url'), job.get('path'), headers, on_error):
+            return False
+
+        if key is not None:
+            try:
+                DownloadCache().put(key, job.get('path'))
+            except:
+                print('Не удалось сохранить файл в кэш')
+
+        return True
+
+    def fetch_all(self, jobs, on_error=None) -> bool:
+        # jobs may be a generator, downloads start while the rest of the listing is still being fetched
+        futures = list()
+        taken: set = set()
+        errors: list = list()
+        try:
+            for job in jobs:
+                # Two files must never be written to the same path at the same time, the later one gets a suffix
+                job['path'] = self._get_free_path(job.get('path'), taken)
+                futures.append(self._executor.submit(self.fetch_job, job, on_error))
+        except Exception as e:
+            errors.append(e)
+
+        wait(futures)
+
+        ok = True
+        for future in futures:
+            try:
+                ok = future.result() and ok
+            except Exception as e:
+                errors.append(e)
+
+        # A file that can never be fetched decides the outcome, trying the others again would not help
+        if len(errors) > 0:
+            raise sorted(errors, key=lambda error: not is_permanent(error))[0]
+        elif len(futures) == 0:
+            raise PermanentError('Нет файлов для скачивания')
+
+        return ok
+
+    def _get_free_path(self, file_path: str, taken: set) -> str:
+        base, ext = os.path.splitext(file_path)
+
+        i = 1
+        while file_path in taken:
+            i += 1
+            file_path = '%s (%i)%s' % (base, i, ext)
+
+        taken.add(file_path)
+        return file_path
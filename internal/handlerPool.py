@@ -0,0 +1,40 @@
+import threading
+
+from internal.cloudHandler import CloudHandler
+
+
+class HandlerPool:
+    _factories: dict = {}
+    _instances: dict = {}
+    _lock: threading.Lock = None
+
+    def __init__(self, factories: dict):
+        self._factories = factories
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> CloudHandler:
+        handler = self._instances.get(key)
+        if handler is not None:
+            return handler
+
+        with self._lock:
+            if key not in self._instances:
+                factory = self._factories.get(key)
+                if factory is None:
+                    return None
+
+                self._instances[key] = factory()
+
+            return self._instances.get(key)
+
+    def put(self, key: str, handler: CloudHandler):
+        with self._lock:
+            self._instances[key] = handler
+
+    def reset(self, key: str = None):
+        with self._lock:
+            if key is None:
+                self._instances.clear()
+            else:
+                self._instances.pop(key, None)
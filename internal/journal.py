@@ -0,0 +1,91 @@
+import os
+import json
+import sqlite3
+import threading
+
+from internal.snapshot import WorksheetSnapshot
+
+
+class JobStates:
+    DOWNLOADED: str = 'downloaded'
+    CONVERTED: str = 'converted'
+    FINISHED: str = 'finished'
+
+
+class JobJournal:
+
+    # vars
+
+    _db_path: str = os.path.join(os.getcwd(), '.config', 'journal.db')
+    _conn: sqlite3.Connection = None
+    _lock: threading.Lock = None
+
+    def __init__(self, db_path: str = None):
+        if db_path is not None:
+            self._db_path = db_path
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self._db_path, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS rows ('
+                           'row_id INTEGER PRIMARY KEY, hash TEXT NOT NULL, state TEXT, '
+                           'result_state INTEGER, result TEXT, links TEXT)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS files ('
+                           'row_id INTEGER NOT NULL, key TEXT NOT NULL, link TEXT, PRIMARY KEY (row_id, key))')
+        self._conn.commit()
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM rows LIMIT 1').fetchone() is None
+
+    def start(self, row: dict) -> dict:
+        # A row whose fields changed since it was journaled starts over
+        row_id = row.get('id')
+        _hash = WorksheetSnapshot.get_hash(row)
+
+        with self._lock:
+            stored = self._conn.execute('SELECT hash, state, result_state, result, links FROM rows WHERE row_id = ?',
+                                        (row_id,)).fetchone()
+
+            if stored is None or stored[0] != _hash:
+                self._conn.execute('DELETE FROM files WHERE row_id = ?', (row_id,))
+                self._conn.execute('INSERT OR REPLACE INTO rows (row_id, hash) VALUES (?, ?)', (row_id, _hash))
+                self._conn.commit()
+                return {'state': None, 'uploaded': {}}
+
+            uploaded = {key: link for key, link in
+                        self._conn.execute('SELECT key, link FROM files WHERE row_id = ?', (row_id,)).fetchall()}
+
+        return {
+            'state': stored[1],
+            'result_state': stored[2],
+            'result': stored[3],
+            'links': json.loads(stored[4]) if stored[4] else list(),
+            'uploaded': uploaded
+        }
+
+    def set_state(self, row_id: int, state: str):
+        with self._lock:
+            self._conn.execute('UPDATE rows SET state = ? WHERE row_id = ?', (state, row_id))
+            self._conn.commit()
+
+    def add_file(self, row_id: int, key: str, link: str = None):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO files (row_id, key, link) VALUES (?, ?, ?)',
+                               (row_id, key, link))
+            self._conn.commit()
+
+    def finish(self, row_id: int, result_state: int, result: str, links: list = None):
+        with self._lock:
+            self._conn.execute('UPDATE rows SET state = ?, result_state = ?, result = ?, links = ? WHERE row_id = ?',
+                               (JobStates.FINISHED, result_state, result, json.dumps(links or list()), row_id))
+            self._conn.commit()
+
+    def clear(self, row_ids: list = None):
+        with self._lock:
+            if row_ids is None:
+                self._conn.execute('DELETE FROM files')
+                self._conn.execute('DELETE FROM rows')
+            else:
+                self._conn.executemany('DELETE FROM files WHERE row_id = ?', [(row_id,) for row_id in row_ids])
+                self._conn.executemany('DELETE FROM rows WHERE row_id = ?', [(row_id,) for row_id in row_ids])
+            self._conn.commit()
@@ -0,0 +1,350 @@
+import os
+import threading
+
+from queue import Queue
+
+from internal.vkHandler import VKHandler
+from internal.handlerPool import HandlerPool
+from internal.journal import JobJournal, JobStates
+from internal.retry import Retrier, TransientError, is_permanent
+from internal.cloudHandler import CloudHandler, GDriveItemStates
+from utils.filesystem import FileSystem
+
+
+class Pipeline:
+
+    # consts
+
+    DOWNLOAD_WORKERS: int = 2
+    CONVERT_WORKERS: int = 1
+    UPLOAD_WORKERS: int = 1
+    QUEUE_SIZE: int = 2
+    FLUSH_TICK: int = 5
+
+    DESC: str = '"$title$". $materials$\nРезультат участия: $res$\nАвтор(ы) - $student$, $age$ лет.\n' \
+                'Педагог(и) - $tutor$.\n$school$, $group$'
+    FILE_DESC: str = DESC + '\n\nfile: $file$'
+
+    # vars
+
+    _source_handler: CloudHandler = None
+    _vk_handler: VKHandler = None
+    _handler_pool: HandlerPool = None
+    _journal: JobJournal = None
+    _retrier: Retrier = None
+
+    _on_row = None
+    _on_progress = None
+    _check_albums: bool = False
+
+    _lock: threading.Lock = None
+    _cancelled: threading.Event = None
+    _running: threading.Event = None
+
+    _deferred: list = []
+    _final_pass: bool = False
+    _started: list = []
+
+    total: int = 0
+    uploaded: int = 0
+    failed: int = 0
+    skipped: int = 0
+
+    def __init__(self, source_handler: CloudHandler, vk_handler: VKHandler, handler_pool: HandlerPool,
+                 on_row=None, on_progress=None, check_albums: bool = False):
+        self._source_handler = source_handler
+        self._vk_handler = vk_handler
+        self._handler_pool = handler_pool
+        self._journal = JobJournal()
+        self._retrier = Retrier()
+
+        self._on_row = on_row
+        self._on_progress = on_progress
+        self._check_albums = check_albums
+
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+
+    @staticmethod
+    def get_source_type(link: str):
+        if 'drive.google.com' in link or 'docs.google.com' in link:
+            return 'gdrive'
+        elif 'cloud.mail.ru' in link:
+            return 'mailru'
+        elif 'disk.yandex' in link or 'yadi.sk' in link:
+            return 'yadisk'
+        elif 'youtube.com' in link or 'youtu.be' in link:
+            return 'youtube'
+
+        return None
+
+    def cancel(self):
+        self._cancelled.set()
+        self._running.set()
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def is_paused(self) -> bool:
+        return not self._running.is_set()
+
+    def is_cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def run(self, rows) -> tuple[int, int, int, int]:
+        self.total = self.uploaded = self.failed = self.skipped = 0
+        self._deferred = list()
+        self._final_pass = False
+        self._started = list()
+
+        if not self._journal.is_empty():
+            print('Продолжение прерванной обработки')
+
+        self._vk_handler.clear_album_index()
+        if self._check_albums:
+            try:
+                self._vk_handler.load_album_index()
+            except:
+                print('Не удалось получить содержимое альбомов')
+
+        stopped = threading.Event()
+        if hasattr(self._source_handler, 'flush_if_due'):
+            threading.Thread(target=self._flush_loop, args=(stopped,), daemon=True).start()
+
+        try:
+            self._run_pass(rows)
+
+            # Rows hit by errors that outlived their retries get one more pass after everything else is done
+            if len(self._deferred) > 0 and not self.is_cancelled():
+                rows, self._deferred = self._deferred, list()
+                self._final_pass = True
+                self._run_pass(rows)
+        finally:
+            stopped.set()
+
+            if hasattr(self._source_handler, 'flush'):
+                self._source_handler.flush()
+
+        # A cancelled run keeps its journal so the next one continues where it stopped, rows outside this run's
+        # range keep theirs in any case
+        if not self.is_cancelled():
+            self._journal.clear(self._started)
+
+        return self.total, self.uploaded, self.failed, self.skipped
+
+    def _flush_loop(self, stopped: threading.Event):
+        while not stopped.wait(self.FLUSH_TICK):
+            try:
+                self._source_handler.flush_if_due()
+            except:
+                print('Ошибка при записи результатов в таблицу')
+
+    def _run_pass(self, rows):
+        download_queue = Queue(maxsize=self.QUEUE_SIZE)
+        convert_queue = Queue(maxsize=self.QUEUE_SIZE)
+        upload_queue = Queue(maxsize=self.QUEUE_SIZE)
+
+        stages = [
+            (self._download_worker, download_queue, convert_queue, self.DOWNLOAD_WORKERS),
+            (self._convert_worker, convert_queue, upload_queue, self.CONVERT_WORKERS),
+            (self._upload_worker, upload_queue, None, self.UPLOAD_WORKERS)
+        ]
+
+        workers: list[list[threading.Thread]] = list()
+        for worker, in_queue, out_queue, count in stages:
+            threads = [threading.Thread(target=self._loop, args=(worker, in_queue, out_queue), daemon=True)
+                       for _ in range(count)]
+            for thread in threads:
+                thread.start()
+            workers.append(threads)
+
+        try:
+            for row in rows:
+                self._running.wait()
+                if self.is_cancelled():
+                    break
+
+                if not self._final_pass:
+                    self._notify_row(row)
+
+                entry = self._journal.start(row)
+                self._started.append(row.get('id'))
+                if entry.get('state') == JobStates.FINISHED and entry.get('result_state') in \
+                        (GDriveItemStates.FINISHED.value, GDriveItemStates.SKIPPED.value):
+                    # Finished before the interruption, only the sheet mark is repeated in case it was not flushed
+                    self._finish(row, GDriveItemStates(entry.get('result_state')), entry.get('result'),
+                                 entry.get('links'), journal=False)
+                    continue
+
+                download_queue.put({'row': row, 'source': self.get_source_type(row.get('link')), 'journal': entry})
+        finally:
+            # Each stage is drained before the next one receives its stop markers, also when reading rows
+            # fails, so no worker outlives the run
+            for i, (_, in_queue, _, count) in enumerate(stages):
+                for _ in range(count):
+                    in_queue.put(None)
+                for thread in workers[i]:
+                    thread.join()
+
+    def _loop(self, worker, in_queue: Queue, out_queue: Queue):
+        while True:
+            job = in_queue.get()
+            if job is None:
+                break
+
+            self._running.wait()
+            if self.is_cancelled():
+                if job.get('prepared') is not None:
+                    self._vk_handler.discard(job.get('prepared'))
+                FileSystem(os.path.join(self._vk_handler._download_path, str(job.get('row').get('id')))).remove()
+                self._notify_progress(job.get('row').get('no'), 2, 'Обработка отменена')
+                continue
+
+            try:
+                if worker(job) and out_queue is not None:
+                    out_queue.put(job)
+            except:
+                if not self._defer(job):
+                    self._finish(job.get('row'), GDriveItemStates.FAILED, 'Ошибка при обработке')
+
+    def _download_worker(self, job: dict) -> bool:
+        row = job.get('row')
+
+        if job.get('source') is None:
+            self._notify_progress(row.get('no'), 2, 'Ошибка: неподдерживаемый источник')
+            return False
+        elif job.get('source') == 'youtube':
+            return True
+
+        path = os.path.join(self._vk_handler._download_path, str(row.get('id')))
+        state = job.get('journal').get('state')
+        if state == JobStates.DOWNLOADED and os.path.isdir(path) and len(os.listdir(path)) > 0:
+            self._notify_progress(row.get('no'), 1)
+            return True
+
+        # Files left by a crash or by the row before it was edited must not be uploaded with the new download, the
+        # folder is fetched again (mostly from the download cache)
+        FileSystem(path).remove()
+
+        try:
+            download_handler = self._handler_pool.get(job.get('source'))
+
+            # A single video is piped from the cloud straight into VK instead of being downloaded first
+            streams: list[dict] = list()
+            self._retrier.call(self._download, download_handler, row, streams.append)
+            if len(streams) > 0:
+                job['stream'] = streams[-1]
+                self._notify_progress(row.get('no'), 1)
+                return True
+        except Exception as e:
+            # A missing or closed link is reported right away, the deferred pass would only fail on it again
+            if is_permanent(e) or not self._defer(job):
+                self._finish(row, GDriveItemStates.FAILED, 'Ошибка при скачивании')
+            return False
+
+        self._journal.set_state(row.get('id'), JobStates.DOWNLOADED)
+        self._notify_progress(row.get('no'), 1)
+        return True
+
+    def _download(self, download_handler: CloudHandler, row: dict, on_stream=None):
+        # Errors with a status are raised by the handlers, False is left for failures that may pass, like a download
+        # that stopped halfway
+        if not download_handler.download(row.get('link'), str(row.get('id')), on_stream=on_stream):
+            raise TransientError('Ошибка при скачивании')
+
+    def _convert_worker(self, job: dict) -> bool:
+        if job.get('source') != 'youtube' and 'stream' not in job:
+            job['prepared'] = self._vk_handler.prepare(job.get('row'))
+            self._journal.set_state(job.get('row').get('id'), JobStates.CONVERTED)
+
+        return True
+
+    def _upload_worker(self, job: dict) -> bool:
+        row = job.get('row')
+        links: list[str] = list()
+
+        done = job.get('journal').get('uploaded')
+        on_uploaded = self._file_uploaded(row)
+
+        try:
+            if job.get('source') == 'youtube':
+                total, uploaded, failed, skipped = self._vk_handler\
+                    .upload_from_link(row, self.DESC, links=links, done=done, on_uploaded=on_uploaded)
+            elif 'stream' in job:
+                total, uploaded, failed, skipped = self._vk_handler\
+                    .upload_stream(row, self.FILE_DESC, job.get('stream'), on_progress=self._upload_progress(row),
+                                   links=links, done=done, on_uploaded=on_uploaded)
+            else:
+                total, uploaded, failed, skipped = self._vk_handler\
+                    .upload_prepared(row, self.FILE_DESC, job.get('prepared'), on_progress=self._upload_progress(row),
+                                     links=links, done=done, on_uploaded=on_uploaded)
+        except:
+            if not self._defer(job):
+                self._finish(row, GDriveItemStates.FAILED, 'Ошибка при загрузке в ВК')
+            return False
+
+        # Files uploaded so far are journaled, the deferred pass only sends the ones that failed
+        if failed > 0 and self._defer(job):
+            return False
+
+        with self._lock:
+            self.total += total
+            self.uploaded += uploaded
+            self.failed += failed
+            self.skipped += skipped
+
+        if uploaded == 0:
+            if failed == 0 and skipped > 0:
+                self._finish(row, GDriveItemStates.SKIPPED, 'Работа пропущена: неподдериваемый формат')
+            else:
+                self._finish(row, GDriveItemStates.FAILED, 'Ошибка при загрузке в ВК')
+        elif uploaded < total:
+            self._finish(row, GDriveItemStates.PARTIAL,
+                         'Частично загружено (возможно, неподдерживаемые файлы или ошибка при загрузке)', links)
+        else:
+            self._finish(row, GDriveItemStates.FINISHED, 'Работа загружена', links)
+
+        return True
+
+    def _defer(self, job: dict) -> bool:
+        if self._final_pass or self.is_cancelled():
+            return False
+
+        with self._lock:
+            self._deferred.append(job.get('row'))
+
+        self._notify_progress(job.get('row').get('no'), 1, 'Повтор в конце обработки')
+        return True
+
+    def _finish(self, row: dict, state: GDriveItemStates, result: str, links: list = None, journal: bool = True):
+        self._source_handler.mark_as(state, row.get('no'), result, links)
+
+        if journal:
+            self._journal.finish(row.get('id'), state.value, result, links)
+
+        self._notify_progress(row.get('no'), 2, result)
+
+    def _file_uploaded(self, row: dict):
+        def record(key: str, link: str):
+            self._journal.add_file(row.get('id'), key, link)
+
+        return record
+
+    def _upload_progress(self, row: dict):
+        def notify(sent: int, size: int):
+            self._notify_progress(row.get('no'), 1, 'Загрузка видео: %i%%' % (sent * 100 // size))
+
+        return notify
+
+    def _notify_row(self, row: dict):
+        if self._on_row is not None:
+            self._on_row(row.get('no'), row.get('title'))
+
+    def _notify_progress(self, no: int, stage: int, result: str = ''):
+        if self._on_progress is not None:
+            self._on_progress(no, stage, result)
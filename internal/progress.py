@@ -0,0 +1,44 @@
+from queue import Queue, Empty
+
+
+class ProgressEvents:
+    ROW: str = 'row'
+    PROGRESS: str = 'progress'
+    DONE: str = 'done'
+
+
+class ProgressChannel:
+
+    # consts
+
+    MAX_EVENTS_PER_FRAME: int = 256
+
+    # vars
+
+    _queue: Queue = None
+
+    def __init__(self):
+        self._queue = Queue()
+
+    def post(self, event: str, *args):
+        self._queue.put((event, args))
+
+    def add_row(self, no: int, title: str):
+        self.post(ProgressEvents.ROW, no, title)
+
+    def update(self, no: int, stage: int, result: str = ''):
+        self.post(ProgressEvents.PROGRESS, no, stage, result)
+
+    def done(self, total: int, uploaded: int, failed: int, skipped: int):
+        self.post(ProgressEvents.DONE, total, uploaded, failed, skipped)
+
+    def drain(self, limit: int = MAX_EVENTS_PER_FRAME) -> list[tuple[str, tuple]]:
+        events: list = list()
+
+        while len(events) < limit:
+            try:
+                events.append(self._queue.get_nowait())
+            except Empty:
+                break
+
+        return events
@@ -0,0 +1,120 @@
+import time
+import random
+import requests
+
+from vk_api import ApiError, ApiHttpError
+from googleapiclient.errors import HttpError
+
+
+class TransientError(Exception):
+    pass
+
+
+class UploadServerError(Exception):
+    pass
+
+
+class PermanentError(Exception):
+    pass
+
+
+class ErrorClasses:
+    NETWORK: str = 'network'
+    SERVER: str = 'server'
+    FLOOD: str = 'flood'
+    UPLOAD_SERVER: str = 'upload_server'
+
+
+def classify(error: BaseException):
+    if isinstance(error, UploadServerError):
+        return ErrorClasses.UPLOAD_SERVER
+    elif isinstance(error, ApiError):
+        # Too many requests per second, flood control / unknown and internal server errors
+        if error.code in (6, 9):
+            return ErrorClasses.FLOOD
+        elif error.code in (1, 10):
+            return ErrorClasses.SERVER
+        return None
+    elif get_status(error) is not None:
+        # Request timeout and too many requests are the only client errors that pass by themselves
+        status = get_status(error)
+        if status >= 500:
+            return ErrorClasses.SERVER
+        elif status == 429:
+            return ErrorClasses.FLOOD
+        elif status == 408:
+            return ErrorClasses.NETWORK
+        return None
+    elif isinstance(error, requests.exceptions.JSONDecodeError):
+        # Upload servers answer overload with an HTML page
+        return ErrorClasses.SERVER
+    elif isinstance(error, (TransientError, requests.ConnectionError, requests.Timeout, ConnectionError,
+                            TimeoutError)):
+        return ErrorClasses.NETWORK
+    elif error.__cause__ is not None:
+        return classify(error.__cause__)
+
+    return None
+
+
+def get_status(error: BaseException):
+    if isinstance(error, (ApiHttpError, requests.HTTPError)) and error.response is not None:
+        return error.response.status_code
+    elif isinstance(error, HttpError):
+        return error.resp.status
+
+    return None
+
+
+def is_permanent(error: BaseException) -> bool:
+    # Missing, private and unsupported links fail the same way however many times they are tried
+    if isinstance(error, PermanentError):
+        return True
+    elif get_status(error) is not None:
+        return get_status(error) < 500 and classify(error) is None
+    elif error.__cause__ is not None:
+        return is_permanent(error.__cause__)
+
+    return False
+
+
+class Retrier:
+
+    # consts
+
+    # attempts, base delay and delay cap in seconds per error class
+    POLICIES: dict = {
+        ErrorClasses.NETWORK: (4, 1.0, 30.0),
+        ErrorClasses.SERVER: (3, 2.0, 60.0),
+        ErrorClasses.FLOOD: (2, 10.0, 60.0),
+        ErrorClasses.UPLOAD_SERVER: (2, 0.5, 5.0)
+    }
+
+    # vars
+
+    _policies: dict = {}
+
+    def __init__(self, policies: dict = None):
+        self._policies = policies or self.POLICIES
+
+    def call(self, fn, *args, **kwargs):
+        attempts: dict = {}
+
+        while True:
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                kind = classify(e)
+                if kind not in self._policies:
+                    raise
+
+                attempt = attempts.get(kind, 0) + 1
+                if attempt >= self._policies.get(kind)[0]:
+                    raise
+
+                attempts[kind] = attempt
+                time.sleep(self.get_delay(kind, attempt - 1))
+
+    def get_delay(self, kind: str, attempt: int) -> float:
+        _, base, cap = self._policies.get(kind)
+        return min(base * 2 ** attempt, cap) * random.uniform(0.5, 1)
@@ -27,6 +27,8 @@ class Settings(metaclass=Singleton):
         self._data['login'] = login
         self._data['group'] = group
 
+    def set_value(self, key: str, value):
+        self._data[key] = value
 
     def save(self):
         with open(self._settings_file_path, 'w+') as f:
@@ -0,0 +1,57 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+
+
+class WorksheetSnapshot:
+
+    # consts
+
+    FIELDS: tuple = ('id', 'school', 'group', 'student', 'age', 'tutor', 'title', 'materials', 'link', 'comm', 'res')
+
+    # vars
+
+    _db_path: str = os.path.join(os.getcwd(), '.config', 'snapshot.db')
+    _conn: sqlite3.Connection = None
+    _lock: threading.Lock = None
+
+    def __init__(self, db_path: str = None):
+        if db_path is not None:
+            self._db_path = db_path
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self._db_path, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS rows ('
+                           'sheet_id TEXT NOT NULL, worksheet_id INTEGER NOT NULL, row_id INTEGER NOT NULL, '
+                           'hash TEXT NOT NULL, state INTEGER NOT NULL, '
+                           'PRIMARY KEY (sheet_id, worksheet_id, row_id))')
+        self._conn.commit()
+
+    @classmethod
+    def get_hash(cls, row: dict) -> str:
+        data = json.dumps([str(row.get(field)) for field in cls.FIELDS], ensure_ascii=False)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def get_done(self, sheet_id: str, worksheet_id: int) -> dict:
+        with self._lock:
+            cursor = self._conn.execute('SELECT row_id, hash, state FROM rows WHERE sheet_id = ? AND worksheet_id = ?',
+                                        (sheet_id, worksheet_id))
+            return {row_id: (_hash, state) for row_id, _hash, state in cursor.fetchall()}
+
+    def is_changed(self, done: dict, row: dict, done_states: tuple) -> bool:
+        stored = done.get(row.get('id'))
+        return stored is None or stored[0] != self.get_hash(row) or stored[1] not in done_states
+
+    def commit(self, sheet_id: str, worksheet_id: int, rows: list[tuple[int, str, int]]):
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO rows (sheet_id, worksheet_id, row_id, hash, state) '
+                                   'VALUES (?, ?, ?, ?, ?)',
+                                   [(sheet_id, worksheet_id, row_id, _hash, state) for row_id, _hash, state in rows])
+            self._conn.commit()
+
+    def clear(self, sheet_id: str, worksheet_id: int):
+        with self._lock:
+            self._conn.execute('DELETE FROM rows WHERE sheet_id = ? AND worksheet_id = ?', (sheet_id, worksheet_id))
+            self._conn.commit()
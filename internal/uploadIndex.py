@@ -0,0 +1,69 @@
+import os
+import sqlite3
+import hashlib
+import threading
+
+
+class UploadIndex:
+
+    # consts
+
+    CHUNK_SIZE: int = 1024 * 1024
+
+    # vars
+
+    _db_path: str = os.path.join(os.getcwd(), '.config', 'uploads.db')
+    _conn: sqlite3.Connection = None
+    _lock: threading.Lock = None
+
+    def __init__(self, db_path: str = None):
+        if db_path is not None:
+            self._db_path = db_path
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self._db_path, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS uploads ('
+                           'hash TEXT NOT NULL, kind TEXT NOT NULL, album_id INTEGER NOT NULL, '
+                           'owner_id INTEGER NOT NULL, item_id INTEGER NOT NULL, row_id INTEGER, '
+                           'PRIMARY KEY (hash, kind, album_id))')
+        self._conn.commit()
+
+    @staticmethod
+    def new_digest():
+        return hashlib.sha1()
+
+    @classmethod
+    def hash_bytes(cls, data: bytes) -> str:
+        return hashlib.sha1(data).hexdigest()
+
+    @classmethod
+    def hash_file(cls, file_path: str) -> str:
+        digest = cls.new_digest()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(cls.CHUNK_SIZE), b''):
+                digest.update(chunk)
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def get_link(kind: str, owner_id: int, item_id: int) -> str:
+        return 'https://vk.com/%s%i_%i' % (kind, owner_id, item_id)
+
+    def get(self, digest: str, kind: str, album_id: int):
+        if digest is None:
+            return None
+
+        with self._lock:
+            found = self._conn.execute('SELECT owner_id, item_id FROM uploads WHERE hash = ? AND kind = ? AND '
+                                       'album_id = ?', (digest, kind, album_id)).fetchone()
+
+        return self.get_link(kind, *found) if found is not None else None
+
+    def add(self, digest: str, kind: str, album_id: int, owner_id: int, item_id: int, row_id: int = None):
+        if digest is None:
+            return
+
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO uploads (hash, kind, album_id, owner_id, item_id, row_id) '
+                               'VALUES (?, ?, ?, ?, ?, ?)', (digest, kind, album_id, owner_id, item_id, row_id))
+            self._conn.commit()
@@ -1,17 +1,44 @@
 import os
 import json
+import time
+import requests
+import threading
+
+from io import BytesIO
 
 from internal.settings import Settings
+from internal.uploadIndex import UploadIndex
+from internal.vkSession import LimitedVkApi
+from internal.retry import Retrier, UploadServerError
 from utils.filesystem import FileSystem
+from utils.multipart import MultipartStream
+from utils.pipe import SpillPipe, start_pump
+from utils.rateLimiter import AdaptiveLimiter
+from utils.conversion import ConversionPool, MemoryBudget
 
 from vk_api import *
+from vk_api.upload import FilesOpener
 from vk_api.vk_api import VkApiMethod
 
 
 class VKHandler:
+
+    # consts
+
+    PHOTO_BATCH_SIZE: int = 5
+    UPLOAD_SERVER_TTL: int = 600
+    MEMORY_BUDGET: int = 256 * 1024 * 1024
+
+    # vars
+
     _api: VkApiMethod = None
     _uploader: VkUpload = None
     _settings: Settings = None
+    _conversion_pool: ConversionPool = None
+    _memory_budget: MemoryBudget = None
+    _upload_index: UploadIndex = None
+    _limiter: AdaptiveLimiter = None
+    _retrier: Retrier = None
 
     _config_path: str = os.path.join(os.getcwd(), '.config')
     _download_path: str = os.path.join(os.getcwd(), '.temp')
@@ -24,8 +51,23 @@ class VKHandler:
     photo_album_id: int = 0
     video_album_id: int = 0
 
+    _upload_servers: dict = {}
+    _upload_servers_lock: threading.Lock = None
+
+    _album_index: dict = None
+    _album_index_lock: threading.Lock = None
+
     def __init__(self):
         self._settings = Settings()
+        self._conversion_pool = ConversionPool()
+        self._memory_budget = MemoryBudget(self.MEMORY_BUDGET)
+        self._upload_index = UploadIndex()
+        # One limiter for every API call made by this handler, uploads and album listing included
+        self._limiter = AdaptiveLimiter()
+        self._retrier = Retrier()
+        self._upload_servers = {}
+        self._upload_servers_lock = threading.Lock()
+        self._album_index_lock = threading.Lock()
 
     def auth_with_token(self) -> bool:
         try:
@@ -38,8 +80,8 @@ class VKHandler:
                 token = json.loads(token)
 
                 try:
-                    session = VkApi(login=token.get('login'), token=token.get('token'),
-                                    config_filename=self._vkconf_path)
+                    session = LimitedVkApi(login=token.get('login'), token=token.get('token'),
+                                           config_filename=self._vkconf_path, limiter=self._limiter)
                     session.auth()
 
                     self._api = session.get_api()
@@ -58,7 +100,8 @@ class VKHandler:
 
     def auth_with_creds(self, login: str, password: str):
         try:
-            session = vk_api.VkApi(login=login, password=password, config_filename=self._vkconf_path)
+            session = LimitedVkApi(login=login, password=password, config_filename=self._vkconf_path,
+                                   limiter=self._limiter)
             session.auth()
 
             with open(self._token_path, "w+", encoding='utf-8') as f:
@@ -74,6 +117,9 @@ class VKHandler:
         except AuthError as err:
             print(err)
 
+    def shutdown(self):
+        self._conversion_pool.shutdown()
+
     def is_auth_required(self) -> bool:
         return self._api is None
 
@@ -111,139 +157,517 @@ class VKHandler:
         if title in self.video_albums.values():
             self.video_album_id = {s for s in self.video_albums if self.video_albums[s] == title}.pop()
 
-    def upload(self, data: dict, desc: str) -> tuple[int, int, int, int]:
-        for key, val in data.items():
-            desc = desc.replace('$%s$' % key, str(val))
+    def load_album_index(self):
+        if self.is_auth_required() and not self.auth_with_token():
+            print('Не удалось авторизоваться')
+            return
+
+        owner_id = -self._settings.get_value('group')
+        tools = VkTools(self._api)
+
+        # Captions are keyed in full, each key keeps one link per uploaded copy (PDF pages share a caption)
+        photos: dict = {}
+        for photo in tools.get_all_iter(method='photos.get', max_count=1000,
+                                        values={'owner_id': owner_id, 'album_id': self.photo_album_id}):
+            photos.setdefault(photo.get('text'), list())\
+                .append('https://vk.com/photo%i_%i' % (photo.get('owner_id'), photo.get('id')))
+
+        videos: dict = {}
+        for video in tools.get_all_iter(method='video.get', max_count=200,
+                                        values={'owner_id': owner_id, 'album_id': self.video_album_id}):
+            videos.setdefault(video.get('description'), list())\
+                .append('https://vk.com/video%i_%i' % (video.get('owner_id'), video.get('id')))
+
+        with self._album_index_lock:
+            self._album_index = {'photo': photos, 'video': videos}
+
+    def clear_album_index(self):
+        with self._album_index_lock:
+            self._album_index = None
 
+    def _take_album_link(self, kind: str, caption: str):
+        with self._album_index_lock:
+            if self._album_index is None:
+                return None
+
+            links = self._album_index.get(kind).get(caption)
+            return links.pop(0) if links else None
+
+    def prepare(self, data: dict) -> list[dict]:
         path = os.path.join(self._download_path, str(data.get('id')))
-        group = self._settings.get_value('group')
 
         fs = FileSystem(path)
-        files = fs.list_files()
-        total = len(files)
-        uploaded = failed = skipped = 0
+        prepared: list[dict] = list()
+        images: list[str] = list()
 
-        for file in files:
+        for file in fs.list_files():
             filename = os.fsdecode(file)
 
             if fs.get_mime(filename) is None:
-                filename = fs.fix_ext(filename)
-                if filename is None:
+                fixed = fs.fix_ext(filename)
+                if fixed is None:
                     print(f'{filename} не удалось обнаружить тип файла')
-                    skipped += 1
+                    prepared.append({'type': 'skipped', 'file': filename})
                     continue
+                filename = fixed
 
             if fs.is_image(filename):
-                if fs.is_heic(filename):
-                    filename = fs.convert_heic_to_jpg(filename)
-                else:
-                    fs.resize_img(filename)
-
-                try:
-                    desc = desc.replace('$file$', filename)
-                    if self._uploader.photo(photos=os.path.join(path, filename), album_id=self.photo_album_id,
-                                            description=desc, group_id=group):
-                        uploaded += 1
-                    else:
-                        failed += 1
-                except:
-                    failed += 1
-                finally:
-                    os.remove(os.path.join(path, filename))
+                images.append(filename)
 
             elif fs.is_pdf(filename):
                 print('pdf')
-                orig = filename
-                tmp_fs = fs.convert_pdf_to_jpg(filename)
-                if tmp_fs is not None:
-                    tmp_files = tmp_fs.list_files()
-                    total += len(tmp_files)-1
-
-                    for file_i in tmp_files:
-                        filename = os.fsdecode(file_i)
-                        try:
-                            desc = desc.replace('$file$', orig)
-                            if self._uploader.photo(photos=os.path.join(tmp_fs.get_path(), filename),
-                                                    album_id=self.photo_album_id, description=desc, group_id=group):
-                                uploaded += 1
-                            else:
-                                failed += 1
-                        except:
-                            failed += 1
-                        finally:
-                            os.remove(os.path.join(tmp_fs.get_path(), filename))
-
-                    tmp_fs.remove()
-                    os.remove(os.path.join(path, orig))
+                pages = None
+                try:
+                    pages = self._conversion_pool.render_pdf(fs, filename, *self.get_pdf_render_options(),
+                                                             in_memory=True, memory_budget=self._memory_budget)
+                except:
+                    pass
 
+                if pages is not None:
+                    prepared.append({'type': 'pages', 'pages': pages, 'file': filename})
                 else:
-                    failed += 1
+                    prepared.append({'type': 'failed', 'file': filename})
 
             elif fs.is_pptx(filename):
                 print('pres')
                 orig = filename
                 tmp_fs = fs.convert_pptx_to_jpg(filename)
+
                 if tmp_fs is not None:
-                    tmp_files = tmp_fs.list_files()
-                    total += len(tmp_files)-1
-
-                    for file_i in tmp_files:
-                        filename = os.fsdecode(file_i)
-                        try:
-                            desc = desc.replace('$file$', orig)
-                            if self._uploader.photo(photos=os.path.join(tmp_fs.get_path(), filename),
-                                                    album_id=self.photo_album_id, description=desc, group_id=group):
-                                uploaded += 1
-                            else:
-                                failed += 1
-                        except:
-                            failed += 1
-                        finally:
-                            os.remove(os.path.join(tmp_fs.get_path(), filename))
+                    for file_i in tmp_fs.list_files():
+                        prepared.append(self._photo_item(os.path.join(tmp_fs.get_path(), os.fsdecode(file_i)), orig))
 
-                    tmp_fs.remove()
                     os.remove(os.path.join(path, orig))
-
                 else:
-                    failed += 1
+                    prepared.append({'type': 'failed', 'file': orig})
 
             elif fs.is_video(filename):
                 print('video')
-                try:
-                    desc = desc.replace('$file$', filename)
-                    if self._uploader.video(video_file=os.path.join(path, filename), album_id=self.video_album_id,
-                                            description=desc, group_id=group, name=data.get('title')):
-                        uploaded += 1
-                    else:
-                        failed += 1
-                except:
-                    failed += 1
-                finally:
-                    os.remove(os.path.join(path, filename))
+                prepared.append({'type': 'video', 'path': os.path.join(path, filename), 'file': filename,
+                                 'hash': self._get_hash(os.path.join(path, filename))})
 
             else:
                 print('skip')
-                skipped += 1
+                prepared.append({'type': 'skipped', 'file': filename})
                 os.remove(os.path.join(path, filename))
 
-        fs.remove()
+        # HEIC decoding and resizing run across processes, results arrive in completion order
+        for orig, filename, data in self._conversion_pool.convert_images(fs, images, in_memory=True,
+                                                                                max_side=self.get_max_side()):
+            if filename is None:
+                prepared.append({'type': 'failed', 'file': orig})
+            else:
+                prepared.append(self._photo_item(os.path.join(path, filename), filename, data))
+
+        return prepared
+
+    def upload(self, data: dict, desc: str) -> tuple[int, int, int, int]:
+        return self.upload_prepared(data, desc, self.prepare(data))
+
+    def upload_prepared(self, data: dict, desc: str, prepared: list[dict], on_progress=None, links: list = None,
+                        done: dict = None, on_uploaded=None) -> tuple[int, int, int, int]:
+        for key, val in data.items():
+            desc = desc.replace('$%s$' % key, str(val))
+
+        group = self._settings.get_value('group')
+
+        total = uploaded = failed = skipped = 0
+
+        batch: list[dict] = list()
+        try:
+            for item in self._iter_prepared(prepared):
+                total += 1
+
+                if item.get('type') in ('photo', 'video'):
+                    item['key'] = self.get_item_key(data, item)
+                    item['row_id'] = data.get('id')
+
+                    # Files uploaded before an interrupted run ended and content already in the album are not sent again
+                    known = done is not None and item.get('key') in done
+                    link = done.get(item.get('key')) if known else \
+                        self._take_album_link(item.get('type'), desc.replace('$file$', item.get('file'))) or \
+                        self._find_uploaded(item)
+
+                    if known or link is not None:
+                        uploaded += 1
+                        if links is not None and link:
+                            links.append(link)
+                        if not known and on_uploaded is not None:
+                            on_uploaded(item.get('key'), link)
+                        self._release(item)
+                        continue
+
+                if item.get('type') == 'skipped':
+                    skipped += 1
+                elif item.get('type') == 'failed':
+                    failed += 1
+                elif item.get('type') == 'photo':
+                    batch.append(item)
+                    if len(batch) == self.PHOTO_BATCH_SIZE:
+                        count = self._upload_photos(batch, desc, group, links, on_uploaded)
+                        uploaded += count
+                        failed += len(batch) - count
+                        batch = list()
+                else:
+                    try:
+                        response = self._upload_video(item.get('path'), data.get('title'),
+                                                      desc.replace('$file$', item.get('file')), group, on_progress)
+                        if response:
+                            uploaded += 1
+                            self._add_video_link(response, links)
+                            self._remember_video(item.get('hash'), response, data.get('id'))
+                            if on_uploaded is not None:
+                                on_uploaded(item.get('key'), self._get_video_link(response))
+                        else:
+                            failed += 1
+                    except:
+                        failed += 1
+                    finally:
+                        os.remove(item.get('path'))
+
+            if len(batch) > 0:
+                count = self._upload_photos(batch, desc, group, links, on_uploaded)
+                uploaded += count
+                failed += len(batch) - count
+        finally:
+            # Buffers left behind by an error are given back, the budget is shared by the whole session
+            for item in batch:
+                self._release(item)
+            self.discard(prepared)
+
+        FileSystem(os.path.join(self._download_path, str(data.get('id')))).remove()
 
         return total, uploaded, failed, skipped
 
-    def upload_from_link(self, data: dict, desc: str) -> tuple[int, int, int, int]:
+    def _iter_prepared(self, prepared: list[dict]):
+        for item in prepared:
+            if item.get('type') != 'pages':
+                yield item
+                continue
+
+            # Rendered pages are uploaded while the rest of the document is still being rendered
+            try:
+                for page_path, data in item.get('pages'):
+                    yield self._photo_item(page_path, item.get('file'), data)
+            except:
+                yield {'type': 'failed', 'file': item.get('file')}
+
+    def get_item_key(self, data: dict, item: dict) -> str:
+        # Files are identified by their path inside the row folder, which stays the same after a restart
+        return os.path.relpath(item.get('path'), os.path.join(self._download_path, str(data.get('id'))))
+
+    def _get_hash(self, file_path: str, data: bytes = None):
+        try:
+            return UploadIndex.hash_bytes(data) if data is not None else UploadIndex.hash_file(file_path)
+        except:
+            return None
+
+    def _find_uploaded(self, item: dict):
+        album_id = self.photo_album_id if item.get('type') == 'photo' else self.video_album_id
+        return self._upload_index.get(item.get('hash'), item.get('type'), album_id)
+
+    def _remember_video(self, digest: str, response: dict, row_id: int):
+        if 'video_id' in response:
+            self._upload_index.add(digest, 'video', self.video_album_id, response.get('owner_id'),
+                                   response.get('video_id'), row_id)
+
+    def _photo_item(self, file_path: str, file: str, data: bytes = None) -> dict:
+        item = {'type': 'photo', 'path': file_path, 'file': file, 'hash': self._get_hash(file_path, data)}
+        if data is None:
+            return item
+
+        # Converted images stay in memory while the budget allows, otherwise they are spilled to disk
+        if self._memory_budget.acquire(len(data)):
+            buffer = BytesIO(data)
+            buffer.name = os.path.basename(file_path)
+            item.update({'data': buffer, 'size': len(data)})
+        else:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'wb') as f:
+                f.write(data)
+
+        return item
+
+    def _release(self, item: dict):
+        if 'data' in item:
+            item.pop('data').close()
+            self._memory_budget.release(item.pop('size'))
+        elif os.path.exists(item.get('path')):
+            os.remove(item.get('path'))
+
+    def discard(self, prepared: list[dict]):
+        for item in prepared:
+            if item.get('type') == 'photo':
+                self._release(item)
+            elif item.get('type') == 'pages':
+                item.get('pages').close()
+
+    def get_max_side(self) -> int:
+        return int(self._settings.get_value('max_side') or FileSystem.MAX_SIDE)
+
+    def get_pdf_render_options(self) -> tuple[int, int]:
+        dpi = self._settings.get_value('pdf_dpi') or FileSystem.PDF_DPI
+
+        return int(dpi), self.get_max_side()
+
+    def _upload_photos(self, items: list[dict], desc: str, group: int, links: list = None,
+                       on_uploaded=None) -> int:
+        captions = [desc.replace('$file$', item.get('file')) for item in items]
+
+        values = {'album_id': self.photo_album_id}
+        if group:
+            values['group_id'] = group
+
+        try:
+            photos = self._retrier.call(self._send_photos, items, captions[0], values, group)
+        except:
+            return 0
+        finally:
+            for item in items:
+                self._release(item)
+
+        if len(photos) != len(items):
+            # Photos can not be matched to their files, so none of them is trusted with a caption
+            for photo in photos:
+                self._delete_photo(photo)
+            return 0
+
+        saved: list[tuple[dict, dict]] = list()
+        for item, photo, caption in zip(items, photos, captions):
+            if caption != captions[0]:
+                try:
+                    self._retrier.call(self._api.photos.edit, owner_id=photo.get('owner_id'), photo_id=photo.get('id'),
+                                       caption=caption)
+                except:
+                    # A photo left with another file's caption would be matched to the wrong file later
+                    print('Не удалось изменить описание фото %i' % photo.get('id'))
+                    self._delete_photo(photo)
+                    continue
+
+            saved.append((item, photo))
+
+        for item, photo in saved:
+            link = 'https://vk.com/photo%i_%i' % (photo.get('owner_id'), photo.get('id'))
+            if links is not None:
+                links.append(link)
+
+            self._upload_index.add(item.get('hash'), 'photo', self.photo_album_id, photo.get('owner_id'),
+                                   photo.get('id'), item.get('row_id'))
+            if on_uploaded is not None:
+                on_uploaded(item.get('key'), link)
+
+        return len(saved)
+
+    def _delete_photo(self, photo: dict):
+        try:
+            self._retrier.call(self._api.photos.delete, owner_id=photo.get('owner_id'), photo_id=photo.get('id'))
+        except:
+            print('Не удалось удалить фото %i' % photo.get('id'))
+
+    def _send_photos(self, items: list[dict], caption: str, values: dict, group: int) -> list:
+        url = self._get_photo_upload_server(self.photo_album_id, group)
+
+        for item in items:
+            if 'data' in item:
+                item.get('data').seek(0)
+
+        try:
+            with FilesOpener([item.get('data') if 'data' in item else item.get('path') for item in items])\
+                    as photo_files:
+                response = self._uploader.http.post(url, files=photo_files).json()
+
+            # Stale or rejected upload server, a new one is requested on the next attempt
+            if 'error' in response or response.get('photos_list') in (None, '', '[]'):
+                raise UploadServerError(response.get('error'))
+
+            if 'album_id' not in response:
+                response['album_id'] = response['aid']
+
+            # photos.save takes a single caption, the rest are set per photo afterwards
+            response['caption'] = caption
+
+            return self._api.photos.save(**dict(values, **response))
+        except:
+            self._invalidate_upload_server(self.photo_album_id, group)
+            raise
+
+    def upload_stream(self, data: dict, desc: str, stream: dict, on_progress=None, links: list = None,
+                      done: dict = None, on_uploaded=None) -> tuple[int, int, int, int]:
+        for key, val in data.items():
+            desc = desc.replace('$%s$' % key, str(val))
+
+        known = done is not None and stream.get('name') in done
+        link = done.get(stream.get('name')) if known else \
+            self._take_album_link('video', desc.replace('$file$', stream.get('name')))
+
+        if known or link is not None:
+            if links is not None and link:
+                links.append(link)
+            if not known and on_uploaded is not None:
+                on_uploaded(stream.get('name'), link)
+            return 1, 1, 0, 0
+
+        group = self._settings.get_value('group')
+
+        try:
+            response, digest = self._send_stream(stream, data.get('title'), desc.replace('$file$', stream.get('name')),
+                                                 group, on_progress)
+            if response:
+                self._add_video_link(response, links)
+                self._remember_video(digest, response, data.get('id'))
+                if on_uploaded is not None:
+                    on_uploaded(stream.get('name'), self._get_video_link(response))
+                return 1, 1, 0, 0
+            else:
+                return 1, 0, 1, 0
+        except:
+            return 1, 0, 1, 0
+
+    def _send_stream(self, stream: dict, name: str, desc: str, group: int, on_progress=None) -> tuple[dict, str]:
+        digests: list = list()
+
+        # Every attempt opens the source again, a stream can not be rewound
+        response = self._save_video(name, desc, group, self._post_stream, stream, digests.append, on_progress)
+
+        return response, digests[-1]
+
+    def _post_stream(self, url: str, stream: dict, on_digest, on_progress=None) -> dict:
+        headers = stream.get('headers')
+        if callable(headers):
+            headers = headers()
+
+        source = stream.get('session').get(stream.get('url'), headers=headers, stream=True)
+        if source.status_code != 200:
+            source.close()
+            raise requests.HTTPError(response=source)
+
+        os.makedirs(self._download_path, exist_ok=True)
+
+        # The source is pumped into a bounded pipe that spills to disk when VK is slower than the cloud
+        pipe = SpillPipe(spill_dir=self._download_path)
+        start_pump(source, pipe)
+
+        # The content is only known once it has passed through, so it is hashed on the way for later runs
+        digest = UploadIndex.new_digest()
+
+        try:
+            uploaded = self._post_video(url, pipe, stream.get('name'), stream.get('size'), on_progress, digest)
+            on_digest(digest.hexdigest())
+            return uploaded
+        finally:
+            source.close()
+            pipe.dispose()
+
+    def _get_video_link(self, response: dict):
+        if 'video_id' not in response:
+            return None
+
+        return 'https://vk.com/video%i_%i' % (response.get('owner_id'), response.get('video_id'))
+
+    def _add_video_link(self, response: dict, links: list = None):
+        if links is not None and 'video_id' in response:
+            links.append(self._get_video_link(response))
+
+    def _upload_video(self, file_path: str, name: str, desc: str, group: int, on_progress=None) -> dict:
+        return self._save_video(name, desc, group, self._post_video_file, file_path, on_progress)
+
+    def _save_video(self, name: str, desc: str, group: int, post, *args, link: str = None) -> dict:
+        values = {'name': name, 'description': desc, 'album_id': self.video_album_id}
+        if group:
+            values['group_id'] = group
+        if link:
+            values['link'] = link
+
+        # Every video.save call creates an album entry, so only the post to the upload url is retried
+        response = self._api.video.save(**values)
+        url = response.pop('upload_url')
+
+        try:
+            response.update(self._retrier.call(post, url, *args))
+        except:
+            self._delete_video(response)
+            raise
+
+        return response
+
+    def _delete_video(self, response: dict):
+        try:
+            self._retrier.call(self._api.video.delete, owner_id=response.get('owner_id'),
+                               video_id=response.get('video_id'))
+        except:
+            print('Не удалось удалить видео %i' % response.get('video_id'))
+
+    def _post_video_file(self, url: str, file_path: str, on_progress=None) -> dict:
+        # The body is streamed from disk so memory use does not grow with the video size
+        with open(file_path, 'rb') as f:
+            return self._post_video(url, f, os.path.basename(file_path), os.path.getsize(file_path), on_progress)
+
+    def _post_video(self, url: str, file=None, filename: str = None, size: int = 0, on_progress=None,
+                    digest=None) -> dict:
+        if file is None:
+            # Videos embedded from a link are fetched by VK itself, the upload url only has to be opened
+            uploaded = self._uploader.http.post(url).json()
+        else:
+            stream = MultipartStream('video_file', filename, file, size, on_progress=on_progress, digest=digest)
+            uploaded = self._uploader.http.post(url, data=stream, headers=stream.get_headers()).json()
+
+        if 'error' in uploaded:
+            raise UploadServerError(uploaded.get('error'))
+
+        return uploaded
+
+    def _get_photo_upload_server(self, album_id: int, group: int, refresh: bool = False) -> str:
+        key = (album_id, group)
+
+        with self._upload_servers_lock:
+            cached = self._upload_servers.get(key)
+            if not refresh and cached is not None and time.monotonic() - cached[1] < self.UPLOAD_SERVER_TTL:
+                return cached[0]
+
+        values = {'album_id': album_id}
+        if group:
+            values['group_id'] = group
+
+        url = self._api.photos.getUploadServer(**values)['upload_url']
+
+        with self._upload_servers_lock:
+            self._upload_servers[key] = (url, time.monotonic())
+
+        return url
+
+    def _invalidate_upload_server(self, album_id: int, group: int):
+        with self._upload_servers_lock:
+            self._upload_servers.pop((album_id, group), None)
+
+    def upload_from_link(self, data: dict, desc: str, links: list = None, done: dict = None,
+                         on_uploaded=None) -> tuple[int, int, int, int]:
         for key, val in data.items():
             desc = desc.replace('$%s$' % key, str(val))
 
         total = uploaded = skipped = failed = 0
         group = self._settings.get_value('group')
 
-        links = data.get('link').split(' ')
-        total = len(links)
-        for link in links:
+        video_links = data.get('link').split(' ')
+        total = len(video_links)
+        for link in video_links:
+            known = done is not None and link in done
+            album_link = done.get(link) if known else self._take_album_link('video', desc)
+
+            if known or album_link is not None:
+                uploaded += 1
+                if links is not None and album_link:
+                    links.append(album_link)
+                if not known and on_uploaded is not None:
+                    on_uploaded(link, album_link)
+                continue
+
             try:
-                if self._uploader.video(link=link, album_id=self.video_album_id,
-                                        description=desc, group_id=group, name=data.get('title')):
+                response = self._save_video(data.get('title'), desc, group, self._post_video, link=link)
+                if response:
                     uploaded += 1
+                    self._add_video_link(response, links)
+                    if on_uploaded is not None:
+                        on_uploaded(link, self._get_video_link(response))
                 else:
                     failed += 1
             except:
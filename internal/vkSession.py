@@ -0,0 +1,49 @@
+import time
+import contextlib
+
+from vk_api import VkApi, ApiError
+
+from utils.rateLimiter import AdaptiveLimiter
+
+
+class LimitedVkApi(VkApi):
+
+    # consts
+
+    # Too many requests per second, flood control
+    THROTTLE_CODES: tuple = (6, 9)
+    RETRIES: int = 6
+
+    RPS_DELAY = 0
+
+    # vars
+
+    _limiter: AdaptiveLimiter = None
+
+    def __init__(self, *args, limiter: AdaptiveLimiter = None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self._limiter = limiter or AdaptiveLimiter()
+
+        # Pacing and concurrency are left to the limiter, throttling errors are raised here instead of slept on
+        self.lock = contextlib.nullcontext()
+        for code in self.THROTTLE_CODES:
+            self.error_handlers[code] = lambda error: None
+
+    def method(self, method, values=None, *args, **kwargs):
+        for attempt in range(self.RETRIES):
+            with self._limiter:
+                started = time.monotonic()
+
+                try:
+                    response = super().method(method, values, *args, **kwargs)
+                except ApiError as e:
+                    if e.code not in self.THROTTLE_CODES or attempt == self.RETRIES - 1:
+                        raise
+
+                    self._limiter.throttled()
+                else:
+                    self._limiter.succeeded(time.monotonic() - started)
+                    return response
+
+            time.sleep(self._limiter.get_backoff(attempt))
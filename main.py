@@ -1,10 +1,15 @@
 import re
+import threading
 
 from dearpygui.dearpygui import *
 
 from internal.settings import Settings
+from internal.pipeline import Pipeline
+from internal.handlerPool import HandlerPool
+from utils.filesystem import FileSystem
+from internal.progress import ProgressChannel, ProgressEvents
 from internal.vkHandler import VKHandler
-from internal.cloudHandler import CloudHandler, GDriveHandler, GDriveItemStates, MailRuHandler, YaDiskHandler
+from internal.cloudHandler import CloudHandler, GDriveHandler, MailRuHandler, YaDiskHandler
 
 current_source_type: str = 'none'
 source_types: dict = {
@@ -24,10 +29,14 @@ download_handlers: dict = {
     'yadisk': YaDiskHandler
 }
 
+handler_pool: HandlerPool = None
+
 is_processing: bool = False
+current_pipeline: Pipeline = None
+progress_channel: ProgressChannel = None
 
-_settings: Settings = Settings()
-_vk_handler: VKHandler = VKHandler()
+_settings: Settings = None
+_vk_handler: VKHandler = None
 
 res_total = res_uploaded = res_failed = res_skipped = 0
 
@@ -39,7 +48,10 @@ def set_current_handler():
 
     if current_source_type in source_handlers:
         handler = source_handlers.get(current_source_type)
-        if handler is not None:
+        if handler is GDriveHandler:
+            # The sheet source and Drive downloads share one authorized client
+            current_source_handler = handler_pool.get('gdrive')
+        elif handler is not None:
             current_source_handler = handler()
         else:
             current_source_handler = handler
@@ -86,7 +98,7 @@ def update_gsheet_range_end(sender, app_data):
 
 
 def process(sender, app_data):
-    global is_processing, res_uploaded, res_total, res_failed, res_skipped
+    global is_processing, current_pipeline, res_uploaded, res_total, res_failed, res_skipped
 
     if not is_processing:
         res_total = res_uploaded = res_failed = res_skipped = 0
@@ -95,94 +107,64 @@ def process(sender, app_data):
 
         is_processing = True
         disable_proc_inputs()
+        create_proc_control_buttons()
 
-        for item in current_source_handler.get_rows(start=get_value('grange_start'), end=get_value('grange_end')):
-            add_progress_table_row(item.get('no'), item.get('title'))
-
-            download_handler: CloudHandler = None
-            if 'drive.google.com' in item.get('link') or 'docs.google.com' in item.get('link'):
-                download_handler = download_handlers.get('gdrive')()
-            elif 'cloud.mail.ru' in item.get('link'):
-                download_handler = download_handlers.get('mailru')()
-            elif 'disk.yandex' in item.get('link') or 'yadi.sk' in item.get('link'):
-                download_handler = download_handlers.get('yadisk')()
-            elif 'youtube.com' in item.get('link') or 'youtu.be' in item.get('link'):
-                total, uploaded, failed, skipped = _vk_handler\
-                    .upload_from_link(item, '"$title$". $materials$\nРезультат участия: $res$\nАвтор(ы) - $student$, $age$ лет.\nПедагог(и) - $tutor$.\n$school$, $group$')
-
-                res_total += total
-                res_uploaded += uploaded
-                res_failed += failed
-                res_skipped += skipped
-
-                if uploaded == 0:
-                    if failed == 0 and skipped > 0:
-                        current_source_handler.mark_as(GDriveItemStates.SKIPPED)
-                        update_progress(item.get('no'), 2, 'Работа пропущена: неподдериваемый формат')
-                    else:
-                        current_source_handler.mark_as(GDriveItemStates.FAILED)
-                        update_progress(item.get('no'), 2, 'Ошибка при загрузке в ВК')
-                else:
-                    if uploaded < total:
-                        current_source_handler.mark_as(GDriveItemStates.PARTIAL)
-                        update_progress(item.get('no'), 2,
-                                        'Частично загружено (возможно, неподдерживаемые файлы или ошибка при загрузке)')
-                    else:
-                        current_source_handler.mark_as(GDriveItemStates.FINISHED)
-                        update_progress(item.get('no'), 2, 'Работа загружена')
-
-                continue
-            else:
-                update_progress(item.get('no'), 2, 'Ошибка: неподдерживаемый источник')
+        current_pipeline = Pipeline(current_source_handler, _vk_handler, handler_pool,
+                                    on_row=progress_channel.add_row, on_progress=progress_channel.update,
+                                    check_albums=get_value('check_albums'))
+        rows = current_source_handler.get_rows(start=get_value('grange_start'), end=get_value('grange_end'),
+                                               only_changed=get_value('only_changed'))
+
+        threading.Thread(target=run_pipeline, args=(current_pipeline, rows), daemon=True).start()
 
-                continue
 
-            try:
-                if not download_handler.download(item.get('link'), str(item.get('id'))):
-                    current_source_handler.mark_as(GDriveItemStates.FAILED)
-                    update_progress(item.get('no'), 2, 'Ошибка при скачивании')
+def run_pipeline(pipeline: Pipeline, rows):
+    try:
+        progress_channel.done(*pipeline.run(rows))
+    except:
+        print('Ошибка при обработке')
+        progress_channel.done(pipeline.total, pipeline.uploaded, pipeline.failed, pipeline.skipped)
 
-                    continue
-            except:
-                current_source_handler.mark_as(GDriveItemStates.FAILED)
-                update_progress(item.get('no'), 2, 'Ошибка при скачивании')
 
-                continue
+def finish_processing(total: int, uploaded: int, failed: int, skipped: int):
+    global is_processing, current_pipeline, res_uploaded, res_total, res_failed, res_skipped
 
-            update_progress(item.get('no'), 1)
+    res_total, res_uploaded, res_failed, res_skipped = total, uploaded, failed, skipped
 
-            try:
-                total, uploaded, failed, skipped = _vk_handler\
-                    .upload(item, '"$title$". $materials$\nРезультат участия: $res$\nАвтор(ы) - $student$, $age$ лет.\nПедагог(и) - $tutor$.\n$school$, $group$\n\nfile: $file$')
-            except:
-                current_source_handler.mark_as(GDriveItemStates.FAILED)
-                update_progress(item.get('no'), 2, 'Ошибка при загрузке в ВК')
+    delete_proc_control_buttons()
+    create_upload_results()
+    current_pipeline = None
+    is_processing = False
+    enable_proc_inputs()
 
-                continue
 
-            res_total += total
-            res_uploaded += uploaded
-            res_failed += failed
-            res_skipped += skipped
+def toggle_pause(sender, app_data):
+    if current_pipeline is None:
+        return
 
-            if uploaded == 0:
-                if failed == 0 and skipped > 0:
-                    current_source_handler.mark_as(GDriveItemStates.SKIPPED)
-                    update_progress(item.get('no'), 2, 'Работа пропущена: неподдериваемый формат')
-                else:
-                    current_source_handler.mark_as(GDriveItemStates.FAILED)
-                    update_progress(item.get('no'), 2, 'Ошибка при загрузке в ВК')
-            else:
-                if uploaded < total:
-                    current_source_handler.mark_as(GDriveItemStates.PARTIAL)
-                    update_progress(item.get('no'), 2, 'Частично загружено (возможно, неподдерживаемые файлы или ошибка при загрузке)')
-                else:
-                    current_source_handler.mark_as(GDriveItemStates.FINISHED)
-                    update_progress(item.get('no'), 2, 'Работа загружена')
+    if current_pipeline.is_paused():
+        current_pipeline.resume()
+        set_item_label('proc_pause_button', 'Пауза')
+    else:
+        current_pipeline.pause()
+        set_item_label('proc_pause_button', 'Продолжить')
+
+
+def cancel_processing(sender, app_data):
+    if current_pipeline is not None:
+        current_pipeline.cancel()
+        disable_item('proc_pause_button')
+        disable_item('proc_cancel_button')
 
-        create_upload_results()
-        is_processing = False
-        enable_proc_inputs()
+
+def drain_progress():
+    for event, args in progress_channel.drain():
+        if event == ProgressEvents.ROW:
+            add_progress_table_row(*args)
+        elif event == ProgressEvents.PROGRESS:
+            update_progress(*args)
+        elif event == ProgressEvents.DONE:
+            finish_processing(*args)
 
 
 def save_settings(sender, app_data):
@@ -192,6 +174,8 @@ def save_settings(sender, app_data):
     group_id = int(re.findall(r'[club|event](\d+)', group_lnk)[0])
 
     _settings.update(login, group_id)
+    _settings.set_value('pdf_dpi', get_value('pdf_dpi'))
+    _settings.set_value('max_side', get_value('max_side'))
     _settings.save()
     update_vk_album_combos()
     delete_settings_window()
@@ -270,6 +254,19 @@ def delete_proc_init_button():
         pass
 
 
+def create_proc_control_buttons():
+    with group(tag='proc_control_buttons', parent='proc_init_inputs', horizontal=True):
+        add_button(tag='proc_pause_button', label='Пауза', callback=toggle_pause)
+        add_button(tag='proc_cancel_button', label='Отменить', callback=cancel_processing)
+
+
+def delete_proc_control_buttons():
+    try:
+        delete_item('proc_control_buttons')
+    except:
+        pass
+
+
 def create_gdrive_file_range_dialog():
     if current_source_type == 'gsheet' and isinstance(current_source_handler, GDriveHandler):
         max_row = current_source_handler.get_last_row_id()
@@ -280,6 +277,8 @@ def create_gdrive_file_range_dialog():
             add_input_int(tag='grange_end', label='Конечный ряд', min_value=get_value('grange_start'),
                           min_clamped=True,
                           default_value=get_value('grange_start'), step=1, max_value=max_row - 4, max_clamped=True)
+            add_checkbox(tag='only_changed', label='Только новые и изменённые ряды', default_value=False)
+            add_checkbox(tag='check_albums', label='Пропускать уже загруженное в альбомы', default_value=False)
 
         create_proc_init_button()
 
@@ -297,6 +296,8 @@ def enable_proc_inputs():
     enable_item('source_file_sub_selector')
     enable_item('grange_start')
     enable_item('grange_end')
+    enable_item('only_changed')
+    enable_item('check_albums')
     enable_item('proc_init_button')
 
 
@@ -305,6 +306,8 @@ def disable_proc_inputs():
     disable_item('source_file_sub_selector')
     disable_item('grange_start')
     disable_item('grange_end')
+    disable_item('only_changed')
+    disable_item('check_albums')
     disable_item('proc_init_button')
 
 
@@ -322,6 +325,13 @@ def create_settings_window():
             add_input_text(tag='vk_group', label='Ссылка на группу',
                            default_value='https://vk.com/club%s' % settings.get('group'))
 
+        with group(label='Обработка файлов'):
+            add_input_int(tag='pdf_dpi', label='DPI страниц PDF', min_value=36, min_clamped=True, max_value=600,
+                          max_clamped=True, default_value=settings.get('pdf_dpi') or FileSystem.PDF_DPI)
+            add_input_int(tag='max_side', label='Макс. сторона изображения', min_value=256, min_clamped=True,
+                          max_value=FileSystem.MAX_SIDE, max_clamped=True,
+                          default_value=settings.get('max_side') or FileSystem.MAX_SIDE)
+
         add_button(label='Сохранить', callback=save_settings)
 
 
@@ -396,61 +406,71 @@ def clear_progress_table():
 # GUI
 
 
-create_context()
+if __name__ == '__main__':
+    # Conversion workers import this module again, the handlers are only built in the main process
+    handler_pool = HandlerPool(download_handlers)
+    progress_channel = ProgressChannel()
 
-with font_registry():
-    with font('resources/fonts/OpenSans-Regular.ttf', 18) as font:
-        add_font_range_hint(mvFontRangeHint_Default)
-        add_font_range_hint(mvFontRangeHint_Cyrillic)
+    _settings = Settings()
+    _vk_handler = VKHandler()
 
-    bind_font(font)
+    create_context()
 
-with window(tag='main'):
-    with menu_bar():
-        with menu(label='Файл'):
-            add_menu_item(label='Настройки', callback=create_settings_window)
+    with font_registry():
+        with font('resources/fonts/OpenSans-Regular.ttf', 18) as font:
+            add_font_range_hint(mvFontRangeHint_Default)
+            add_font_range_hint(mvFontRangeHint_Cyrillic)
 
-    if _vk_handler.is_auth_required() and not _vk_handler.auth_with_token():
-        with window(tag='vk_auth', label='Повторите вход', pos=(20, 20), width=300, height=150, no_resize=True,
-                    on_close=delete_vk_login_prompt):
-            add_input_text(tag='vk_login', label='Логин', default_value=_settings.get_value('login'))
-            add_input_text(tag='vk_pass', label='Пароль', password=True)
-            add_input_text(tag='vk_2fa', label='Код двухфакторной авторизации')
-            add_button(label='Вход', callback=vk_login_and_close)
+        bind_font(font)
 
-    with group(tag='proc_init_inputs'):
-        with group(tag='source_dialog'):
-            add_combo(label='Тип источника данных', items=list(source_types.values()), callback=set_source_type)
+    with window(tag='main'):
+        with menu_bar():
+            with menu(label='Файл'):
+                add_menu_item(label='Настройки', callback=create_settings_window)
 
-        add_separator()
+        if _vk_handler.is_auth_required() and not _vk_handler.auth_with_token():
+            with window(tag='vk_auth', label='Повторите вход', pos=(20, 20), width=300, height=150, no_resize=True,
+                        on_close=delete_vk_login_prompt):
+                add_input_text(tag='vk_login', label='Логин', default_value=_settings.get_value('login'))
+                add_input_text(tag='vk_pass', label='Пароль', password=True)
+                add_input_text(tag='vk_2fa', label='Код двухфакторной авторизации')
+                add_button(label='Вход', callback=vk_login_and_close)
 
-        with group(tag='dest_dialog'):
-            add_combo(tag='vk_photo', label='Альбом для фото', items=_vk_handler.get_albums_photo(),
-                      callback=vk_set_photo_album)
-            add_combo(tag='vk_album', label='Альбом для видео', items=_vk_handler.get_albums_video(),
-                      callback=vk_set_video_album)
+        with group(tag='proc_init_inputs'):
+            with group(tag='source_dialog'):
+                add_combo(label='Тип источника данных', items=list(source_types.values()), callback=set_source_type)
 
-    add_separator()
+            add_separator()
+
+            with group(tag='dest_dialog'):
+                add_combo(tag='vk_photo', label='Альбом для фото', items=_vk_handler.get_albums_photo(),
+                          callback=vk_set_photo_album)
+                add_combo(tag='vk_album', label='Альбом для видео', items=_vk_handler.get_albums_video(),
+                          callback=vk_set_video_album)
+
+        add_separator()
 
-    with child_window(height=256):
-        with table(tag='progress_table', header_row=True, borders_innerH=True, borders_innerV=True, borders_outerH=True,
-                   borders_outerV=True):
+        with child_window(height=256):
+            with table(tag='progress_table', header_row=True, borders_innerH=True, borders_innerV=True,
+                       borders_outerH=True, borders_outerV=True):
 
-            add_table_column(label='ID и название')
-            add_table_column(label='Прогресс')
-            add_table_column(label='Результат')
+                add_table_column(label='ID и название')
+                add_table_column(label='Прогресс')
+                add_table_column(label='Результат')
 
 
-configure_app(manual_callback_management=True)
-create_viewport(title='vkUploaderEX', width=800, height=800)
-setup_dearpygui()
-show_viewport()
-set_primary_window('main', True)
-# start_dearpygui()
+    configure_app(manual_callback_management=True)
+    create_viewport(title='vkUploaderEX', width=800, height=800)
+    setup_dearpygui()
+    show_viewport()
+    set_primary_window('main', True)
+    # start_dearpygui()
 
-while is_dearpygui_running():
-    jobs = get_callback_queue()  # retrieves and clears queue
-    run_callbacks(jobs)
-    render_dearpygui_frame()
+    while is_dearpygui_running():
+        jobs = get_callback_queue()  # retrieves and clears queue
+        run_callbacks(jobs)
+        drain_progress()
+        render_dearpygui_frame()
 
-destroy_context()
+    destroy_context()
+    _vk_handler.shutdown()
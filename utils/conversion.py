@@ -0,0 +1,169 @@
+import os
+import threading
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from utils.filesystem import FileSystem
+
+
+def convert_image(path: str, filename: str, in_memory: bool = False, max_side: int = FileSystem.MAX_SIDE) -> tuple:
+    fs = FileSystem(path)
+
+    if in_memory:
+        if fs.is_heic(filename):
+            return fs.get_heic_jpg_name(filename), fs.convert_heic_to_jpg_bytes(filename, max_side)
+
+        return filename, fs.resize_img_bytes(filename, max_side)
+
+    if fs.is_heic(filename):
+        return fs.convert_heic_to_jpg(filename, max_side), None
+
+    fs.resize_img(filename, max_side)
+    return filename, None
+
+
+def render_pdf_range(path: str, filename: str, first: int, last: int, dpi: int, max_side: int,
+                     in_memory: bool = False) -> list:
+    return FileSystem(path).render_pdf_pages(filename, first, last, dpi, max_side, in_memory)
+
+
+class MemoryBudget:
+    _limit: int = 0
+    _used: int = 0
+    _lock: threading.Lock = None
+
+    def __init__(self, limit: int):
+        self._limit = limit
+        self._lock = threading.Lock()
+
+    def acquire(self, size: int) -> bool:
+        with self._lock:
+            if self._used + size > self._limit:
+                return False
+
+            self._used += size
+            return True
+
+    def release(self, size: int):
+        with self._lock:
+            self._used = max(self._used - size, 0)
+
+    def available(self) -> int:
+        with self._lock:
+            return self._limit - self._used
+
+
+class ConversionPool:
+
+    # consts
+
+    PDF_CHUNK_PAGES: int = 4
+    PDF_CHUNKS_AHEAD: int = 2
+    PAGE_SIZE_ESTIMATE: int = 1024 * 1024
+
+    # vars
+
+    _workers: int = 0
+    _executor: ProcessPoolExecutor = None
+    _lock: threading.Lock = None
+
+    def __init__(self, workers: int = None):
+        self._workers = workers or os.cpu_count() or 1
+        self._lock = threading.Lock()
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self._workers)
+
+            return self._executor
+
+    def submit(self, fn, *args):
+        executor = self.get_executor()
+        try:
+            return executor.submit(fn, *args)
+        except BrokenProcessPool:
+            # A worker that crashed on a bad file breaks the whole pool, a fresh one takes over
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+
+            return self.get_executor().submit(fn, *args)
+
+    def _result(self, future, fn, *args):
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            return self.submit(fn, *args).result()
+
+    def convert_images(self, fs: FileSystem, filenames: list[str], in_memory: bool = False,
+                       max_side: int = FileSystem.MAX_SIDE):
+        if len(filenames) == 0:
+            return
+
+        futures = {self.submit(convert_image, fs.get_path(), filename, in_memory, max_side): filename
+                   for filename in filenames}
+
+        for future in as_completed(futures):
+            try:
+                yield (futures[future],) + self._result(future, convert_image, fs.get_path(), futures[future],
+                                                        in_memory, max_side)
+            except:
+                yield futures[future], None, None
+
+    def render_pdf(self, fs: FileSystem, filename: str, dpi: int = FileSystem.PDF_DPI,
+                   max_side: int = FileSystem.MAX_SIDE, in_memory: bool = False, memory_budget: MemoryBudget = None):
+        count = fs.get_pdf_page_count(filename)
+        if count == 0:
+            return None
+
+        job = {
+            'path': fs.get_path(), 'filename': filename, 'dpi': dpi, 'max_side': max_side, 'in_memory': in_memory,
+            'budget': memory_budget, 'page_size': self.PAGE_SIZE_ESTIMATE,
+            'chunks': deque((first, min(first + self.PDF_CHUNK_PAGES, count))
+                            for first in range(0, count, self.PDF_CHUNK_PAGES))
+        }
+
+        # Only a few chunks are rendered ahead of the upload, so a long document never sits in memory whole
+        pending = deque()
+        while len(pending) < self.PDF_CHUNKS_AHEAD and len(job.get('chunks')) > 0:
+            pending.append(self._submit_pdf_chunk(job))
+
+        return self._iter_pages(job, pending)
+
+    def _submit_pdf_chunk(self, job: dict):
+        first, last = job.get('chunks').popleft()
+
+        # A chunk is rendered to memory only while the budget can hold it, otherwise its pages go to disk
+        in_memory = job.get('in_memory') and \
+            (job.get('budget') is None or job.get('budget').available() >= job.get('page_size') * (last - first))
+
+        args = (job.get('path'), job.get('filename'), first, last, job.get('dpi'), job.get('max_side'), in_memory)
+        return self.submit(render_pdf_range, *args), args
+
+    def _iter_pages(self, job: dict, pending: deque):
+        # Pages come out in document order as (path, bytes or None), each chunk is dropped once consumed
+        try:
+            while len(pending) > 0:
+                future, args = pending.popleft()
+                if len(job.get('chunks')) > 0:
+                    pending.append(self._submit_pdf_chunk(job))
+
+                for page in self._result(future, render_pdf_range, *args):
+                    if isinstance(page, tuple):
+                        job['page_size'] = max(job.get('page_size'), len(page[1]))
+                        yield page
+                    else:
+                        yield page, None
+        finally:
+            for future, _ in pending:
+                future.cancel()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
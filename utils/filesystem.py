@@ -3,13 +3,22 @@ import shutil
 import warnings
 import mimetypes
 
-from fitz import Document
+from fitz import Document, Matrix
 from wand.image import Image
 
+import pythoncom
 import win32com.client as client
 
 
 class FileSystem:
+
+    # consts
+
+    PDF_DPI: int = 150
+    MAX_SIDE: int = 7000
+
+    # vars
+
     _path: str = ''
 
     def __init__(self, path: str):
@@ -21,23 +30,51 @@ class FileSystem:
     def list_files(self) -> list:
         return os.listdir(self._path)
 
-    def convert_pdf_to_jpg(self, filename: str):
-        file = os.path.join(self._path, filename)
-
-        with Document(file) as doc:
+    def get_pdf_page_count(self, filename: str) -> int:
+        with Document(os.path.join(self._path, filename)) as doc:
             if not doc.is_pdf:
-                return None
+                return 0
 
-            new_dir = os.path.join(self._path, filename.replace('.pdf', ''))
-            os.makedirs(new_dir)
+            return doc.page_count
 
-            i: int = 1
-            for page in doc.pages():
-                pix = page.get_pixmap()
-                pix.save(os.path.join(new_dir, '%i.jpg' % i))
-                i += 1
+    def get_pdf_pages_dir(self, filename: str) -> str:
+        return os.path.join(self._path, filename.replace('.pdf', ''))
 
-            return FileSystem(new_dir)
+    def render_pdf_pages(self, filename: str, first: int, last: int,
+                         dpi: int = PDF_DPI, max_side: int = MAX_SIDE, in_memory: bool = False) -> list:
+        new_dir = self.get_pdf_pages_dir(filename)
+        if not in_memory:
+            os.makedirs(new_dir, exist_ok=True)
+
+        pages: list[str] = list()
+        with Document(os.path.join(self._path, filename)) as doc:
+            for i in range(first, last):
+                page = doc.load_page(i)
+
+                zoom = dpi / 72
+                longest = max(page.rect.width, page.rect.height) * zoom
+                if longest > max_side:
+                    zoom *= max_side / longest
+
+                pix = page.get_pixmap(matrix=Matrix(zoom, zoom))
+                page_path = os.path.join(new_dir, '%i.jpg' % (i + 1))
+
+                if in_memory:
+                    pages.append((page_path, pix.tobytes('jpg')))
+                else:
+                    pix.save(page_path)
+                    pages.append(page_path)
+
+        return pages
+
+    def convert_pdf_to_jpg(self, filename: str, dpi: int = PDF_DPI, max_side: int = MAX_SIDE):
+        count = self.get_pdf_page_count(filename)
+        if count == 0:
+            return None
+
+        self.render_pdf_pages(filename, 0, count, dpi, max_side)
+
+        return FileSystem(self.get_pdf_pages_dir(filename))
 
     def convert_pptx_to_jpg(self, filename: str):
         file = os.path.join(self._path, filename)
@@ -49,29 +86,38 @@ class FileSystem:
             new_dir = os.path.join(self._path, filename.replace(ext, ''))
             os.makedirs(new_dir)
 
-            powerpoint = client.Dispatch('PowerPoint.Application')
-            doc = powerpoint.Presentations.Open(file)
-
-            i: int = 1
-            for slide in doc.Slides:
-                slide.Export(os.path.join(new_dir, '%i.jpg' % i), 'JPG')
-                i += 1
-
-            doc.Close()
-            doc = None
-            print('doc close')
-            powerpoint.Quit()
-            print('ppt quit')
-            del powerpoint
-            print('ppt del')
+            # Conversion runs on a pipeline worker thread, COM has to be initialised on each of them
+            pythoncom.CoInitialize()
+            try:
+                powerpoint = client.Dispatch('PowerPoint.Application')
+                doc = powerpoint.Presentations.Open(file)
+
+                i: int = 1
+                for slide in doc.Slides:
+                    slide.Export(os.path.join(new_dir, '%i.jpg' % i), 'JPG')
+                    i += 1
+
+                doc.Close()
+                doc = None
+                print('doc close')
+                powerpoint.Quit()
+                print('ppt quit')
+                del powerpoint
+                print('ppt del')
+            finally:
+                pythoncom.CoUninitialize()
+
             return FileSystem(new_dir)
         except:
             return None
 
-    def convert_heic_to_jpg(self, filename: str) -> str:
+    def get_heic_jpg_name(self, filename: str) -> str:
+        return filename.lower().replace('.heic', '.jpg')
+
+    def convert_heic_to_jpg(self, filename: str, max_side: int = MAX_SIDE) -> str:
         file = os.path.join(self._path, filename)
 
-        new_filename = filename.lower().replace('.heic', '.jpg')
+        new_filename = self.get_heic_jpg_name(filename)
         new_path = os.path.join(self._path, new_filename)
 
         open(new_path, 'wb').close()
@@ -80,32 +126,54 @@ class FileSystem:
             warnings.simplefilter('ignore')
             with Image(filename=file) as img:
                 img.format = 'jpg'
-
-                if img.width > 7000 or img.height > 7000:
-                    if img.width > img.height:
-                        img.transform(resize='7000x')
-                    else:
-                        img.transform(resize='x7000')
-
+                self.fit_img(img, max_side)
                 img.save(filename=new_path)
 
         os.remove(file)
 
         return new_filename
 
-    def resize_img(self, filename: str):
+    def convert_heic_to_jpg_bytes(self, filename: str, max_side: int = MAX_SIDE) -> bytes:
+        file = os.path.join(self._path, filename)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            with Image(filename=file) as img:
+                img.format = 'jpg'
+                self.fit_img(img, max_side)
+                return img.make_blob()
+
+    def resize_img(self, filename: str, max_side: int = MAX_SIDE):
         file = os.path.join(self._path, filename)
 
         with warnings.catch_warnings():
             warnings.simplefilter('ignore')
             with Image(filename=file) as img:
-                if img.width > 7000 or img.height > 7000:
-                    if img.width > img.height:
-                        img.transform(resize='7000x')
-                    else:
-                        img.transform(resize='x7000')
+                if self.fit_img(img, max_side):
                     img.save(filename=file)
 
+    def resize_img_bytes(self, filename: str, max_side: int = MAX_SIDE):
+        file = os.path.join(self._path, filename)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            with Image(filename=file) as img:
+                if self.fit_img(img, max_side):
+                    return img.make_blob()
+
+        return None
+
+    def fit_img(self, img: Image, max_side: int = MAX_SIDE) -> bool:
+        if img.width > max_side or img.height > max_side:
+            if img.width > img.height:
+                img.transform(resize='%ix' % max_side)
+            else:
+                img.transform(resize='x%i' % max_side)
+
+            return True
+
+        return False
+
     def get_mime(self, filename: str):
         file = os.path.join(self._path, filename)
         (mime, _) = mimetypes.guess_type(file)
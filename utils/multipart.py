@@ -0,0 +1,100 @@
+import uuid
+
+
+class MultipartStream:
+
+    # consts
+
+    PROGRESS_STEP: int = 4 * 1024 * 1024
+
+    # vars
+
+    content_type: str = ''
+
+    _head: bytes = b''
+    _tail: bytes = b''
+    _file = None
+    _size: int = 0
+    _file_read: int = 0
+
+    _parts: list = []
+    _sent: int = 0
+    _reported: int = 0
+    _on_progress = None
+    _digest = None
+
+    def __init__(self, field: str, filename: str, file, size: int,
+                 file_type: str = 'application/octet-stream', on_progress=None, digest=None):
+        boundary = uuid.uuid4().hex
+
+        self.content_type = 'multipart/form-data; boundary=%s' % boundary
+
+        self._head = ('--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\nContent-Type: %s\r\n\r\n' %
+                      (boundary, field, filename.replace('"', ''), file_type)).encode('utf-8')
+        self._tail = ('\r\n--%s--\r\n' % boundary).encode('utf-8')
+        self._file = file
+        self._size = size
+
+        self._parts = [self._head, self._file, self._tail]
+        self._on_progress = on_progress
+        # A hashlib object is fed with the file contents as they are sent
+        self._digest = digest
+
+    def __len__(self) -> int:
+        return len(self._head) + self._size + len(self._tail)
+
+    def get_headers(self) -> dict:
+        return {
+            'Content-Type': self.content_type,
+            'Content-Length': str(len(self))
+        }
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = len(self) - self._sent
+
+        chunks: list[bytes] = list()
+        left = size
+        while left > 0 and len(self._parts) > 0:
+            part = self._parts[0]
+
+            if isinstance(part, bytes):
+                data = part[:left]
+
+                if len(data) == len(part):
+                    self._parts.pop(0)
+                else:
+                    self._parts[0] = part[len(data):]
+            else:
+                # The declared size goes into Content-Length, the file may neither fall short of it nor exceed it
+                data = part.read(min(left, self._size - self._file_read)) if self._file_read < self._size else b''
+                if not data:
+                    if self._file_read < self._size:
+                        raise ConnectionError('Файл оказался короче заявленного размера: %i из %i' %
+                                              (self._file_read, self._size))
+                    self._parts.pop(0)
+                    continue
+
+                self._file_read += len(data)
+
+                if self._digest is not None:
+                    self._digest.update(data)
+
+            chunks.append(data)
+            left -= len(data)
+
+        chunk = b''.join(chunks)
+        self._sent += len(chunk)
+        self._report()
+
+        return chunk
+
+    def _report(self):
+        if self._on_progress is None:
+            return
+
+        finished = self._sent == len(self) and self._reported != self._sent
+
+        if self._sent - self._reported >= self.PROGRESS_STEP or finished:
+            self._reported = self._sent
+            self._on_progress(self._sent, len(self))
@@ -0,0 +1,151 @@
+import tempfile
+import threading
+
+from collections import deque
+
+
+class SpillPipe:
+
+    # consts
+
+    MEMORY_LIMIT: int = 64 * 1024 * 1024
+    SPILL_LIMIT: int = 1024 * 1024 * 1024
+
+    # vars
+
+    _memory_limit: int = 0
+    _spill_limit: int = 0
+    _chunks: deque = None
+    _offset: int = 0
+    _buffered: int = 0
+
+    _spill = None
+    _spill_dir: str = None
+    _spill_read: int = 0
+    _spill_written: int = 0
+
+    _closed: bool = False
+    _disposed: bool = False
+    _error: Exception = None
+    _cond: threading.Condition = None
+
+    def __init__(self, memory_limit: int = MEMORY_LIMIT, spill_dir: str = None, spill_limit: int = SPILL_LIMIT):
+        self._memory_limit = memory_limit
+        self._spill_limit = spill_limit
+        self._chunks = deque()
+        self._cond = threading.Condition()
+        self._spill_dir = spill_dir
+
+    def write(self, data: bytes):
+        if not data:
+            return
+
+        with self._cond:
+            while True:
+                if self._disposed:
+                    raise IOError('Поток закрыт')
+
+                spilled = self._spill_written - self._spill_read
+
+                # Once spilling starts everything goes to disk until the reader catches up, so order is kept
+                if spilled == 0 and self._buffered + len(data) <= self._memory_limit:
+                    self._chunks.append(data)
+                    self._buffered += len(data)
+                    break
+
+                # A full spill file blocks the writer until the reader frees some of it
+                if spilled == 0 or spilled + len(data) <= self._spill_limit:
+                    if self._spill is None:
+                        self._spill = tempfile.TemporaryFile(dir=self._spill_dir)
+
+                    self._spill.seek(self._spill_written)
+                    self._spill.write(data)
+                    self._spill_written += len(data)
+                    break
+
+                self._cond.wait()
+
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def fail(self, error: Exception):
+        with self._cond:
+            self._error = error
+            self._closed = True
+            self._cond.notify_all()
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self._memory_limit
+
+        with self._cond:
+            while True:
+                if self._error is not None:
+                    raise IOError('Источник потока недоступен') from self._error
+
+                if len(self._chunks) > 0:
+                    # Small reads move an offset into the first chunk, only the part returned is copied
+                    head = self._chunks[0]
+                    chunk = head[self._offset:self._offset + size]
+                    self._offset += len(chunk)
+                    if self._offset == len(head):
+                        self._chunks.popleft()
+                        self._offset = 0
+
+                    self._buffered -= len(chunk)
+                    self._cond.notify_all()
+                    return chunk
+
+                if self._spill_written > self._spill_read:
+                    self._spill.seek(self._spill_read)
+                    chunk = self._spill.read(min(size, self._spill_written - self._spill_read))
+                    self._spill_read += len(chunk)
+
+                    if self._spill_read == self._spill_written:
+                        self._spill.seek(0)
+                        self._spill.truncate()
+                        self._spill_read = self._spill_written = 0
+
+                    self._cond.notify_all()
+                    return chunk
+
+                if self._closed:
+                    return b''
+
+                self._cond.wait()
+
+    def dispose(self):
+        with self._cond:
+            self._disposed = True
+
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+
+            self._chunks.clear()
+            self._offset = 0
+            self._buffered = 0
+
+            self._cond.notify_all()
+
+
+def pump(source, pipe: SpillPipe, chunk_size: int = 1024 * 1024):
+    try:
+        for chunk in source.iter_content(chunk_size=chunk_size):
+            pipe.write(chunk)
+        pipe.close()
+    except Exception as e:
+        pipe.fail(e)
+    finally:
+        source.close()
+
+
+def start_pump(source, pipe: SpillPipe) -> threading.Thread:
+    thread = threading.Thread(target=pump, args=(source, pipe), daemon=True)
+    thread.start()
+
+    return thread
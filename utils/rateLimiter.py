@@ -0,0 +1,97 @@
+import time
+import random
+import threading
+
+
+class AdaptiveLimiter:
+
+    # consts
+
+    RATE: float = 3.0
+    MIN_RATE: float = 0.5
+    MAX_RATE: float = 20.0
+    RATE_STEP: float = 0.05
+
+    CONCURRENCY: float = 2.0
+    MIN_CONCURRENCY: float = 1.0
+    MAX_CONCURRENCY: float = 8.0
+
+    LATENCY_TARGET: float = 2.0
+
+    BACKOFF_BASE: float = 0.5
+    BACKOFF_MAX: float = 30.0
+
+    # vars
+
+    _rate: float = 0
+    _tokens: float = 0
+    _refilled: float = 0
+
+    _concurrency: float = 0
+    _in_flight: int = 0
+
+    _cond: threading.Condition = None
+
+    def __init__(self, rate: float = RATE, concurrency: float = CONCURRENCY):
+        self._rate = rate
+        self._tokens = 1
+        self._refilled = time.monotonic()
+
+        self._concurrency = concurrency
+        self._in_flight = 0
+
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                self._refill()
+
+                if self._in_flight < int(self._concurrency) and self._tokens >= 1:
+                    self._tokens -= 1
+                    self._in_flight += 1
+                    return
+
+                # Without a free slot the wait ends on release, without a token when the next one is due
+                timeout = (1 - self._tokens) / self._rate if self._tokens < 1 else None
+                self._cond.wait(timeout)
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def succeeded(self, latency: float):
+        # Additive increase while calls are fast, multiplicative decrease once they slow down
+        with self._cond:
+            if latency <= self.LATENCY_TARGET:
+                self._concurrency = min(self._concurrency + 1 / self._concurrency, self.MAX_CONCURRENCY)
+                self._rate = min(self._rate + self.RATE_STEP, self.MAX_RATE)
+            else:
+                self._concurrency = max(self._concurrency / 2, self.MIN_CONCURRENCY)
+
+            self._cond.notify_all()
+
+    def throttled(self):
+        with self._cond:
+            self._refill()
+
+            self._rate = max(self._rate / 2, self.MIN_RATE)
+            self._concurrency = max(self._concurrency / 2, self.MIN_CONCURRENCY)
+            self._tokens = min(self._tokens, 0)
+
+    def get_backoff(self, attempt: int) -> float:
+        return min(self.BACKOFF_BASE * 2 ** attempt, self.BACKOFF_MAX) * random.uniform(0.5, 1)
+
+    def _refill(self):
+        now = time.monotonic()
+        # The bucket holds at most one second worth of calls
+        self._tokens = min(self._tokens + (now - self._refilled) * self._rate, max(self._rate, 1))
+        self._refilled = now
@@ -0,0 +1,65 @@
+import threading
+
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TreeWalker:
+
+    # consts
+
+    WORKERS: int = 4
+
+    # vars
+
+    _list_dir = None
+    _workers: int = 0
+
+    def __init__(self, list_dir, workers: int = WORKERS):
+        # list_dir(node) returns a list of files and a list of nodes still to visit (subfolders, next pages)
+        self._list_dir = list_dir
+        self._workers = workers
+
+    def walk(self, roots: list):
+        if len(roots) == 0:
+            return
+
+        results = Queue()
+        lock = threading.Lock()
+        pending = [len(roots)]
+        executor = ThreadPoolExecutor(max_workers=self._workers)
+
+        def visit(node):
+            try:
+                files, nodes = self._list_dir(node)
+
+                with lock:
+                    pending[0] += len(nodes)
+                for _node in nodes:
+                    executor.submit(visit, _node)
+
+                results.put(('files', files))
+            except Exception as e:
+                results.put(('error', e))
+            finally:
+                with lock:
+                    pending[0] -= 1
+                    if pending[0] == 0:
+                        results.put(('done', None))
+
+        for root in roots:
+            executor.submit(visit, root)
+
+        try:
+            while True:
+                kind, value = results.get()
+
+                if kind == 'done':
+                    break
+                elif kind == 'error':
+                    raise value
+
+                for file in value:
+                    yield file
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)